@@ -0,0 +1,63 @@
+import gc
+import os
+import sys
+import numpy
+import cloud_env
+import my_logger
+from device import Device
+from file_manager import SharedFile
+from timed_structures import TimedData
+
+
+# Numero di oggetti creati per ogni misura
+N_OBJECTS = 10 ** 5
+
+
+def rss():
+    """
+    Ritorna la memoria residente del processo (bytes), letta da /proc/self/statm
+    """
+    with open('/proc/self/statm') as fp:
+        pages = int(fp.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(build):
+    """
+    Ritorna la coppia (oggetti creati da "build", bytes residenti occupati): gli oggetti vengono mantenuti in vita
+    durante la misura, per cui la memoria dei contenitori che li raccolgono e' inclusa
+    """
+    gc.collect()
+    before = rss()
+    objects = build()
+    gc.collect()
+    return objects, rss() - before
+
+
+def bench(n=N_OBJECTS):
+    """
+    Stampa la memoria occupata per dispositivo, per cartella condivisa e per file con "n" dispositivi
+    """
+    numpy.random.seed(0)
+    results = []
+    # Rete completa: dispositivi (con il loro timer simpy), cartelle condivise e archi
+    env, used = measure(lambda: cloud_env.CloudEnvironment(n, my_logger.NullLogger()))
+    n_sf = len(env.shared_folders)
+    results.append(('network, per device', used, n))
+    # Dispositivi aggiuntivi, non collegati alla rete: costo marginale di Device e del suo timer simpy
+    devices, used = measure(lambda: [Device(n + i, env.env, env.file_manager, env.stats, env) for i in range(n)])
+    results.append(('Device + simpy timer', used, n))
+    sf = env.shared_folders[0]
+    cf = env.file_manager.new_upload()
+    files, used = measure(lambda: [SharedFile.from_cloud(cf, sf, i, 0) for i in range(n)])
+    results.append(('SharedFile', used, n))
+    data, used = measure(lambda: [TimedData(i, i) for i in range(n)])
+    results.append(('TimedData', used, n))
+
+    print('### MEMORY (%d devices, %d shared folders) ###' % (n, n_sf))
+    for label, used, count in results:
+        print('%s: %.1f bytes' % (label, float(used) / count))
+
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else N_OBJECTS)
@@ -0,0 +1,129 @@
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+import numpy
+import bench_utils
+
+
+# Numero di dispositivi dei punti del benchmark
+SIZES = [100, 1000, 10000, 100000]
+# Durata simulata (s) e seed, uguali per tutti i punti
+UNTIL = 20000
+SEED = 0
+# Risultati di riferimento, versionati nel repository: vengono registrati (sulla macchina su cui si eseguono i
+# confronti) con "--output bench_scaling.baseline.json", e aggiornati nello stesso commit di ogni modifica che cambia
+# volutamente le prestazioni o la simulazione (numero di eventi)
+BASELINE = 'bench_scaling.baseline.json'
+# Peggioramento massimo rispetto al baseline, relativo: durata della simulazione e della generazione, memoria
+THRESHOLDS = {'run_time': 0.2, 'generation_time': 0.2, 'peak_rss': 0.1}
+# Peggioramento assoluto al di sotto del quale le differenze sono considerate rumore (s, bytes)
+TOLERANCES = {'run_time': 0.1, 'generation_time': 0.1, 'peak_rss': 4 * 2 ** 20}
+
+
+def run_point(n_devices, server, until=UNTIL, seed=SEED):
+    """
+    Esegue un punto del benchmark nel processo corrente e ne ritorna le misure
+    """
+    import cloud_env
+    import my_logger
+    import samplers
+    random.seed(seed)
+    numpy.random.seed(seed)
+    samplers.reset()
+    start = time.time()
+    env = cloud_env.CloudEnvironment(n_devices, my_logger.NullLogger(), server=server)
+    generation_time = time.time() - start
+    start = time.time()
+    env.run(until, report=False)
+    run_time = time.time() - start
+    # Ogni evento e' un timer di un dispositivo: quelli processati sono i timer creati e non piu' in sospeso
+    events = env.n_timers - sum([len(d.timers()) for d in env.devices.itervalues()])
+    return {
+        'n_devices': n_devices,
+        'server': server,
+        'generation_time': generation_time,
+        'run_time': run_time,
+        'events': events,
+        'events_per_sec': events / run_time if run_time > 0 else 0.0,
+        # Linux: ru_maxrss in KB
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def run_subprocess(n_devices, server, until=UNTIL, seed=SEED):
+    """
+    Esegue un punto del benchmark in un processo dedicato, in modo che il picco di memoria sia solo il suo
+    """
+    cmd = [sys.executable, __file__, '--point', str(n_devices), '--until', str(until), '--seed', str(seed)]
+    if not server:
+        cmd.append('--p2p')
+    return json.loads(subprocess.check_output(cmd).splitlines()[-1])
+
+
+def point_key(point):
+    return point['n_devices'], point['server']
+
+
+def describe(point):
+    return '%s, %d devices' % ('server' if point['server'] else 'P2P', point['n_devices'])
+
+
+def compare(results, baseline, thresholds=THRESHOLDS):
+    """
+    Confronta i risultati con il baseline, punto per punto: ritorna l'elenco delle regressioni (messaggi), tra cui i
+    punti con un numero di eventi diverso (la simulazione e' cambiata)
+    """
+    if (baseline['until'], baseline['seed']) != (results['until'], results['seed']):
+        return ['the baseline was recorded with a different horizon or seed']
+    regressions = bench_utils.compare(results, baseline, point_key, describe, thresholds, TOLERANCES)
+    reference = dict((point_key(p), p) for p in baseline['points'])
+    for point in results['points']:
+        base = reference.get(point_key(point))
+        if base is not None and base['events'] != point['events']:
+            regressions.append('%s: %d events instead of %d (the simulation has changed)' % (
+                describe(point), point['events'], base['events']))
+    return regressions
+
+
+def print_point(point):
+    print('%-6s %7d devices: generation %7.2f s, run %8.2f s, %9d events (%7.0f events/s), peak RSS %6.0f MB' % (
+        'server' if point['server'] else 'P2P', point['n_devices'], point['generation_time'], point['run_time'],
+        point['events'], point['events_per_sec'], point['peak_rss'] / 2.0 ** 20))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scaling benchmark of CloudEnvironment, in server and P2P modes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numbers of devices')
+    parser.add_argument('--modes', nargs='+', choices=['server', 'p2p'], default=['server', 'p2p'])
+    parser.add_argument('--until', type=int, default=UNTIL, help='simulated time (s)')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--output', default='bench_scaling.json', help='file where the results are written')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='results to compare with: exits with status 1 on a regression (empty: no comparison)')
+    parser.add_argument('--point', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--p2p', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.point is not None:
+        # Processo figlio: un solo punto, risultato su stdout
+        print(json.dumps(run_point(args.point, not args.p2p, args.until, args.seed)))
+        return 0
+
+    results = {'until': args.until, 'seed': args.seed, 'points': []}
+    for server in [mode == 'server' for mode in args.modes]:
+        for n in args.sizes:
+            point = run_subprocess(n, server, args.until, args.seed)
+            print_point(point)
+            results['points'].append(point)
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=2, sort_keys=True)
+
+    return bench_utils.check_baseline(results, args.output, args.baseline, compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
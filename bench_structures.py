@@ -0,0 +1,240 @@
+import argparse
+import json
+import math
+import sys
+import timeit
+import numpy
+import bench_utils
+import cloud_stats as cs
+import timed_structures as ts
+from file_manager import SharedFile
+from shared_folder import SharedFolder
+
+
+# Lunghezze dei TimedArray: le serie di login/logout delle simulazioni registrate in images/ (L2e1, L2e2) hanno circa
+# 150, 2100 e 6700 elementi con 10, 100 e 300 dispositivi; 10^5 e' l'ordine di grandezza di una rete molto piu' grande
+SIZES = [150, 2100, 6700, 100000]
+# Intervalli aperti contemporaneamente in StatsManager: dispositivi online a fine simulazione nelle stesse
+# simulazioni (9, 84 e 421 con 10, 100 e 500 dispositivi), e la stessa frazione (84%) di 10^4 e 10^5 dispositivi
+CONCURRENCY = [9, 84, 421, 8400, 84000]
+# Tempo minimo (s) di misura per punto, e numero massimo di chiamate tra due ricostruzioni della struttura
+BUDGET = 0.2
+MAX_BATCH = 100
+# Risultati di riferimento, versionati nel repository: vengono registrati (sulla macchina su cui si eseguono i
+# confronti) con "--output bench_structures.baseline.json", e aggiornati nello stesso commit di ogni modifica che
+# cambia volutamente le prestazioni delle strutture misurate
+BASELINE = 'bench_structures.baseline.json'
+# Peggioramento massimo rispetto al baseline, relativo e assoluto (us per chiamata) al di sotto del quale le
+# differenze sono considerate rumore
+THRESHOLD = 0.5
+TOLERANCE = 1.0
+
+
+class Clock(object):
+    """
+    Sostituisce l'ambiente simpy di StatsManager, che ne legge solo l'istante corrente
+    """
+
+    def __init__(self):
+        self.now = 0
+
+
+class Peer(object):
+    """
+    Sostituisce un Device, di cui StatsManager legge solo l'id (un Device vero avvierebbe i suoi timer)
+    """
+
+    __slots__ = ('id',)
+
+    def __init__(self, device_id):
+        self.id = device_id
+
+
+def timed_array(n, timestamp=True, n_data=None):
+    """
+    Ritorna un TimedArray di "n" elementi con istanti distinti: i dati si ripetono ogni "n_data" elementi (come gli
+    id dei dispositivi nelle serie per intervallo di StatsManager)
+    """
+    array = ts.TimedArray(timestamp=timestamp)
+    for i in xrange(n):
+        array.append(ts.TimedData(i % n_data if n_data else i, i, timestamp))
+    return array
+
+
+def insert_or_update(n):
+    array = timed_array(n)
+
+    def call(i):
+        # Piu' eventi nello stesso secondo: un nuovo istante ogni due chiamate
+        array.insert_or_update(n + i // 2, i)
+    return call
+
+
+def compact_insert_or_update(n):
+    array = ts.CompactTimedArray()
+    for i in xrange(n):
+        array.append(i, i)
+
+    def call(i):
+        array.insert_or_update(n + i // 2, i)
+    return call
+
+
+def search_by_data(n):
+    # Circa 20 intervalli per dispositivo
+    n_data = max(1, n // 20)
+    array = timed_array(n, timestamp=False, n_data=n_data)
+
+    def call(i):
+        array.search_by_data(i % n_data)
+    return call
+
+
+def remove(n):
+    array = timed_array(n, timestamp=False)
+    # Elementi distinti, distribuiti uniformemente lungo il vettore (uno per chiamata, vedi "measure")
+    step = n // max(1, min(n // 10, MAX_BATCH))
+    items = [ts.TimedData(x.data, x.time, False) for x in array.get_list()[::step]]
+
+    def call(i):
+        array.remove(items[i])
+    return call
+
+
+def filter_time_range(n):
+    array = timed_array(n)
+    width = max(1, n // 10)
+
+    def call(i):
+        array.filter_time_range(i, i + width)
+    return call
+
+
+def stats_manager(c):
+    """
+    Ritorna (StatsManager, orologio, dispositivi, file) con "c" dispositivi
+    """
+    clock = Clock()
+    devices = dict((i, Peer(i)) for i in xrange(c))
+    sf = SharedFolder(0)
+    files = [SharedFile(i, 1000, 1000.0, sf, 0, 0) for i in xrange(c)]
+    return cs.StatsManager(c, devices, clock), clock, devices, files
+
+
+def login_logout(c):
+    stats, clock, devices, _ = stats_manager(c)
+    for d in devices.itervalues():
+        stats.login(d)
+
+    def call(i):
+        clock.now += 1
+        d = devices[i % c]
+        stats.logout(d)
+        stats.login(d)
+    return call
+
+
+def download_start_end(c):
+    stats, clock, devices, files = stats_manager(c)
+    for i in xrange(c):
+        stats.download_start(devices[i], files[i])
+
+    def call(i):
+        clock.now += 1
+        d = devices[i % c]
+        f = files[i % c]
+        stats.download_end(d, f, 1000.0)
+        stats.download_start(d, f)
+    return call
+
+
+# (nome, costruttore della chiamata da misurare, dimensioni)
+BENCHMARKS = [
+    ('TimedArray.insert_or_update', insert_or_update, SIZES),
+    ('TimedArray.search_by_data', search_by_data, SIZES),
+    ('TimedArray.remove', remove, SIZES),
+    ('TimedArray.filter_time_range', filter_time_range, SIZES),
+    ('CompactTimedArray.insert_or_update', compact_insert_or_update, SIZES),
+    ('StatsManager.logout + login', login_logout, CONCURRENCY),
+    ('StatsManager.download_end + download_start', download_start_end, CONCURRENCY),
+]
+
+
+def measure(setup, n, budget=BUDGET):
+    """
+    Ritorna il costo medio (us) di una chiamata creata da setup(n). La struttura viene ricostruita (fuori dalla misura)
+    ogni MAX_BATCH chiamate, o ogni n / 10 se meno, in modo che le chiamate non ne alterino la dimensione di oltre il
+    10%. Il costo include la chiamata della funzione di benchmark, meno di un decimo di us
+    """
+    total = 0.0
+    calls = 0
+    batch = max(1, min(n // 10, MAX_BATCH))
+    while total < budget:
+        call = setup(n)
+        start = timeit.default_timer()
+        for i in xrange(batch):
+            call(i)
+        total += timeit.default_timer() - start
+        calls += batch
+    return total / calls * 1e6
+
+
+def exponent(points):
+    """
+    Ritorna la pendenza della retta di regressione di log(costo) rispetto a log(n): 1 per un costo O(n), 0 per O(1)
+    """
+    if len(points) < 2:
+        return float('nan')
+    x = numpy.log([p['n'] for p in points])
+    y = numpy.log([max(p['us_per_call'], 1e-3) for p in points])
+    return float(numpy.polyfit(x, y, 1)[0])
+
+
+def point_key(point):
+    return point['name'], point['n']
+
+
+def describe(point):
+    return '%s, n = %d' % (point['name'], point['n'])
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Confronta i risultati con il baseline, punto per punto: ritorna l'elenco delle regressioni (messaggi)
+    """
+    return bench_utils.compare(results, baseline, point_key, describe, {'us_per_call': threshold},
+                               {'us_per_call': TOLERANCE})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of TimedArray and of the StatsManager hot methods')
+    parser.add_argument('--only', nargs='+', help='run only the benchmarks whose name contains one of these strings')
+    parser.add_argument('--max-n', type=int, help='skip the points with a larger size or concurrency')
+    parser.add_argument('--budget', type=float, default=BUDGET, help='minimum measured time per point (s)')
+    parser.add_argument('--output', default='bench_structures.json', help='file where the results are written')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='results to compare with: exits with status 1 on a regression (empty: no comparison)')
+    args = parser.parse_args()
+
+    results = {'points': [], 'exponents': {}}
+    for name, setup, sizes in BENCHMARKS:
+        if args.only is not None and not any([s in name for s in args.only]):
+            continue
+        points = []
+        for n in sizes:
+            if args.max_n is not None and n > args.max_n:
+                continue
+            points.append({'name': name, 'n': n, 'us_per_call': measure(setup, n, args.budget)})
+            print('%-45s n = %6d: %10.2f us/call' % (name, n, points[-1]['us_per_call']))
+        results['exponents'][name] = exponent(points)
+        if not math.isnan(results['exponents'][name]):
+            print('%-45s cost ~ n^%.2f' % (name, results['exponents'][name]))
+        results['points'].extend(points)
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=2, sort_keys=True)
+
+    return bench_utils.check_baseline(results, args.output, args.baseline, compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import json
+import os
+
+
+def compare(results, baseline, key, describe, thresholds, tolerances):
+    """
+    Confronta i risultati di un benchmark con il baseline, punto per punto: ritorna l'elenco delle regressioni
+    (messaggi). I punti sono abbinati tramite key(punto) e descritti nei messaggi da describe(punto); una metrica
+    peggiora se supera il baseline sia di "thresholds[metrica]" (relativo) sia di "tolerances[metrica]" (assoluto,
+    al di sotto del quale le differenze sono considerate rumore)
+    """
+    reference = dict((key(p), p) for p in baseline['points'])
+    regressions = []
+    for point in results['points']:
+        base = reference.get(key(point))
+        if base is None:
+            continue
+        for metric, threshold in sorted(thresholds.iteritems()):
+            if point[metric] > base[metric] * (1 + threshold) and point[metric] - base[metric] > tolerances[metric]:
+                regressions.append('%s: %s %.3g -> %.3g (+%.0f%%, threshold %.0f%%)' % (
+                    describe(point), metric, base[metric], point[metric],
+                    (point[metric] / base[metric] - 1) * 100 if base[metric] > 0 else float('inf'), threshold * 100))
+    return regressions
+
+
+def check_baseline(results, output, path, compare):
+    """
+    Confronta i risultati scritti in "output" con il baseline nel file "path", tramite compare(results, baseline), e
+    stampa le regressioni. Ritorna lo stato di uscita del benchmark: 1 se ci sono regressioni o se il baseline non
+    esiste. Non viene fatto alcun confronto se "path" e' vuoto o coincide con "output" (registrazione di un nuovo
+    baseline)
+    """
+    if not path or os.path.abspath(path) == os.path.abspath(output):
+        return 0
+    if not os.path.exists(path):
+        print('No baseline at %s: record one with --output %s' % (path, path))
+        return 1
+    with open(path, 'r') as fp:
+        baseline = json.load(fp)
+    regressions = compare(results, baseline)
+    for message in regressions:
+        print('REGRESSION: ' + message)
+    if len(regressions) > 0:
+        return 1
+    print('No regressions with respect to %s' % path)
+    return 0
@@ -1,9 +1,13 @@
+import cPickle
+import random as py_random
 import cloud_stats as cs
+import numpy
+import samplers
 import simpy
-from collections import deque
 from numpy import random
 from shared_folder import SharedFolder
-from device import Device
+from device import Device, round_robin_allocation
+from peer_index import PeerIndex
 import file_manager as fm
 
 
@@ -13,16 +17,111 @@ DV_DG = [0.470, 1.119]
 SF_DG = [0.231, 0.537]
 
 
+def generate_bipartite(num_dv, dv_dg, sf_dg):
+    """
+    Configuration model for the device/shared folder bipartite graph, with negative binomial degrees
+    :param num_dv: number of devices
+    :param dv_dg: (s, mu) of the number of shared folders per device
+    :param sf_dg: (s, mu) of the number of devices per shared folder
+    :return: (number of shared folders, device of each edge, shared folder of each edge)
+    """
+    # derive the expected number of shared folders using the negative_binomials
+
+    # this piece is just converting the parameterization of the
+    # negative_binomials from (s, mu) to "p". Then, we use the rate between
+    # the means to estimate the expected number of shared folders
+    # from the given number of devices
+
+    dv_s = dv_dg[0]
+    dv_m = dv_dg[1]
+    dv_p = dv_s / (dv_s + dv_m)
+    nd = 1 + (dv_s * (1.0 - dv_p) / dv_p)
+
+    sf_s = sf_dg[0]
+    sf_m = sf_dg[1]
+    sf_p = sf_s / (sf_s + sf_m)
+    dn = 1 + (sf_s * (1.0 - sf_p) / sf_p)
+
+    # the number of shared folders is finally derived
+    num_sf = int(num_dv * nd / dn)
+
+    # sample the number of devices per shared folder (shared folder degree)
+    sf_dgr = random.negative_binomial(sf_s, sf_p, num_sf) + 1
+
+    # sample the number of shared folders per device (device degree)
+    dv_dgr = random.negative_binomial(dv_s, dv_p, num_dv) + 1
+
+    # create the population of edges leaving shared folders (edges are popped from the end)
+    sf_pop = numpy.repeat(numpy.arange(num_sf, dtype=numpy.int64), numpy.minimum(sf_dgr, num_dv))
+    random.shuffle(sf_pop)
+    if len(sf_pop) < num_dv:
+        raise ValueError('the shared folders have %d edges, less than the %d devices' % (len(sf_pop), num_dv))
+
+    # first we pick a random shared folder for each device
+    edges_dv = [numpy.arange(num_dv, dtype=numpy.int64)]
+    edges_sf = [sf_pop[::-1][:num_dv]]
+    sf_pop = sf_pop[:len(sf_pop) - num_dv]
+    # existing edges, encoded as dv * num_sf + sf and kept sorted
+    existing = numpy.sort(edges_dv[0] * num_sf + edges_sf[0])
+
+    # then we complement the shared folder degree
+
+    # we skip devices with degree 1 in a first pass, since they just got 1 sf
+    r = 1
+
+    # we might have less edges leaving devices than necessary
+    while len(sf_pop) > 0:
+        # create the population of edges leaving devices
+        dv_pop = numpy.repeat(numpy.arange(num_dv, dtype=numpy.int64), numpy.clip(dv_dgr - r, 0, num_sf))
+        random.shuffle(dv_pop)
+
+        # if we need to recreate the population, we use devices w/ degree 1 too
+        r = 0
+
+        while len(sf_pop) > 0 and len(dv_pop) > 0:
+            # pair as many edges as possible at once
+            m = min(len(sf_pop), len(dv_pop))
+            dv = dv_pop[::-1][:m]
+            sf = sf_pop[::-1][:m]
+            dv_pop = dv_pop[:len(dv_pop) - m]
+            sf_pop = sf_pop[:len(sf_pop) - m]
+
+            # we are lazy and simply skip the unfortunate repetitions (existing edges or repeated in this batch)
+            keys = dv * num_sf + sf
+            fresh = numpy.zeros(m, dtype=bool)
+            fresh[numpy.unique(keys, return_index=True)[1]] = True
+            pos = numpy.minimum(numpy.searchsorted(existing, keys), len(existing) - 1)
+            fresh &= existing[pos] != keys
+
+            edges_dv.append(dv[fresh])
+            edges_sf.append(sf[fresh])
+            new_keys = numpy.sort(keys[fresh])
+            existing = numpy.insert(existing, numpy.searchsorted(existing, new_keys), new_keys)
+            # rejected shared folder edges are tried again first
+            sf_pop = numpy.concatenate((sf_pop, sf[~fresh][::-1]))
+
+    return num_sf, numpy.concatenate(edges_dv), numpy.concatenate(edges_sf)
+
+
 class CloudEnvironment(object):
     """
     La classe modellizza un servizio Cloud di file sharing
     """
 
-    def __init__(self, n_devices, logger, server=True):
+    def __init__(self, n_devices, logger, server=True, load_bin_width=1, p2p_policy=round_robin_allocation,
+                 dv_dg=DV_DG, sf_dg=SF_DG, stats_sink=None, profiler=None):
         """
         :param n_devices: numero di device della rete
         :param logger: elabora il file di log
         :param server: booleano, indica la presenza di un server centrale (False = P2P)
+        :param load_bin_width: ampiezza (s) degli intervalli su cui viene mediato il carico del server nei grafici
+        :param p2p_policy: funzione (file_size, residual_times, rates) -> (durations, downloaded_data, downloaded) che
+            ripartisce un download P2P tra i peers disponibili
+        :param dv_dg: parametri (s, mu) della binomiale negativa per il numero di shared folder per device
+        :param sf_dg: parametri (s, mu) della binomiale negativa per il numero di device per shared folder
+        :param stats_sink: dove memorizzare le serie storiche delle statistiche (timed_structures.DiskSink per
+            riversarle su disco durante la simulazione; default: in memoria)
+        :param profiler: profiler.Profiler, se la simulazione va strumentata (default: nessuna strumentazione)
         """
         self.env = simpy.Environment()
         self.logger = logger
@@ -30,90 +129,145 @@ class CloudEnvironment(object):
         self.devices = {}
         self.shared_folders = {}
         self.server = server
-        self.stats = cs.StatsManager(n_devices, self.devices, self.env, server)
+        # Indice dei peers, utile solo in modalita' P2P
+        self.peer_index = None if server else PeerIndex()
+        self.p2p_policy = p2p_policy
+        self.dv_dg = dv_dg
+        self.sf_dg = sf_dg
+        # Numero di timer creati finora: ne determina l'ordine a parita' di istante, anche dopo un restore
+        self.n_timers = 0
+        self.stats = cs.StatsManager(n_devices, self.devices, self.env, server, load_bin_width, stats_sink)
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.attach(self)
         self.generate_network(n_devices)
 
-    def run(self, until):
-        # Lancia la simulazione
-        self.stats.new_simulation(until)
-        self.env.run(until=until)
-        # Statistiche di fine elaborazione
-        self.stats.stats()
+    def __getstate__(self):
+        # Ambiente simpy e logger non vengono salvati: vedi "load"
+        if self.profiler is not None:
+            raise ValueError('a simulation with a profiler cannot be saved')
+        state = self.__dict__.copy()
+        state['env'] = None
+        state['logger'] = None
+        return state
 
-    def generate_network(self, num_dv):
-        # derive the expected number of shared folders using the negative_binomials
+    def run(self, until, report=True, monitor=None, plots=True, export_dir=None):
+        # Lancia la simulazione (conclusa in anticipo se "monitor" rileva lo stato stazionario)
+        self.advance(until, monitor)
+        # Statistiche di fine elaborazione (stampa e grafici solo se richiesti: vedi StatsManager.stats)
+        if report:
+            if self.file_manager.logging:
+                self.file_manager.print_log_counts()
+            self.stats.stats(plots, export_dir)
+            if self.profiler is not None:
+                self.profiler.report()
 
-        # this piece is just converting the parameterization of the
-        # negative_binomials from (s, mu) to "p". Then, we use the rate between
-        # the means to estimate the expected number of shared folders
-        # from the given number of devices
+    def advance(self, until, monitor=None):
+        """
+        Prosegue la simulazione fino all'istante "until", senza elaborare le statistiche finali
+        :param monitor: steady_state.SteadyStateMonitor, controllato ogni "monitor.interval" secondi: stima il
+            transitorio da escludere dalle medie, e conclude la simulazione appena le stime sono abbastanza precise
+        """
+        self.stats.new_simulation(until)
+        if monitor is None:
+            self.run_until(until)
+        else:
+            while self.env.now < until:
+                self.run_until(min(self.env.now + monitor.interval, until))
+                if monitor.check(self.stats, self.env.now):
+                    break
+        self.stats.end_simulation(self.env.now)
 
-        dv_s = DV_DG[0]
-        dv_m = DV_DG[1]
-        dv_p = dv_s / (dv_s + dv_m)
-        nd = 1 + (dv_s * (1.0 - dv_p) / dv_p)
+    def run_until(self, until):
+        """
+        Esegue gli eventi della simulazione fino all'istante "until" (tramite il profiler, se presente)
+        """
+        if self.profiler is None:
+            self.env.run(until=until)
+        else:
+            self.profiler.run(self.env, until)
 
-        sf_s = SF_DG[0]
-        sf_m = SF_DG[1]
-        sf_p = sf_s / (sf_s + sf_m)
-        dn = 1 + (sf_s * (1.0 - sf_p) / sf_p)
+    def next_timer(self):
+        """
+        Ritorna il numero d'ordine del prossimo timer
+        """
+        self.n_timers += 1
+        return self.n_timers - 1
 
-        # the number of shared folders is finally derived
-        num_sf = int(num_dv * nd / dn)
+    def start_timer(self, delay, callback, *args):
+        """
+        Chiama callback(*args) tra "delay" secondi di simulazione
+        """
+        timer = self.env.timeout(delay)
+        timer.callbacks.append(lambda event: callback(*args))
 
-        # sample the number of devices per shared folder (shared folder degree)
-        sf_dgr = [x + 1 for x in random.negative_binomial(sf_s, sf_p, num_sf)]
+    def save(self, path):
+        """
+        Salva nel file "path" lo stato completo della simulazione all'istante corrente (dispositivi, cartelle condivise,
+        versioni dei file, statistiche, timer in sospeso e stato dei generatori casuali). Le serie riversate su disco
+        da un DiskSink non vengono copiate: restano nei file del sink, di cui viene registrata la lunghezza
+        """
+        state = {
+            'now': self.env.now,
+            'cloud_env': self,
+            'random': py_random.getstate(),
+            'numpy_random': random.get_state(),
+            'samplers': samplers.get_state(),
+        }
+        with open(path, 'wb') as fp:
+            cPickle.dump(state, fp, cPickle.HIGHEST_PROTOCOL)
 
-        # sample the number of shared folders per device (device degree)
-        dv_dgr = [x + 1 for x in random.negative_binomial(dv_s, dv_p, num_dv)]
+    @classmethod
+    def load(cls, path, logger):
+        """
+        Ricrea una simulazione salvata con "save" nel file "path", pronta per proseguire con "advance" o "run". I
+        generatori casuali riprendono dallo stato salvato
+        :param logger: elabora il file di log della simulazione ripristinata
+        """
+        with open(path, 'rb') as fp:
+            state = cPickle.load(fp)
+        cloud_env = state['cloud_env']
+        cloud_env.env = simpy.Environment(initial_time=state['now'])
+        cloud_env.logger = logger
+        cloud_env.file_manager.set_logger(logger)
+        cloud_env.stats.env = cloud_env.env
+        for d in cloud_env.devices.itervalues():
+            d.env = cloud_env.env
+        for sf in cloud_env.shared_folders.itervalues():
+            sf.devices = [cloud_env.devices[dv_id] for dv_id in sf.devices]
+        py_random.setstate(state['random'])
+        random.set_state(state['numpy_random'])
+        samplers.set_state(state['samplers'])
+        # Ricreo i timer in sospeso, nello stesso ordine in cui erano stati creati
+        timers = []
+        for d in cloud_env.devices.itervalues():
+            timers.extend(d.timers())
+        timers.sort(key=lambda x: (x[0], x[1]))
+        for at, _, callback, args in timers:
+            cloud_env.start_timer(at - cloud_env.env.now, callback, *args)
+        return cloud_env
 
-        # create the population of edges leaving shared folders
-        l = [i for i, j in enumerate(sf_dgr) for k in range(min(j, num_dv))]
-        random.shuffle(l)
-        sf_pop = deque(l)
+    def generate_network(self, num_dv):
+        # sample the bipartite device/shared folder graph as edge arrays
+        num_sf, edge_dv, edge_sf = generate_bipartite(num_dv, self.dv_dg, self.sf_dg)
 
-        # create empty shared folders
+        # create empty shared folders and devices
         for sf_id in range(num_sf):
             self.shared_folders[sf_id] = SharedFolder(sf_id)
-
-        # first we pick a random shared folder for each device
         for dv_id in range(num_dv):
             self.devices[dv_id] = Device(dv_id, self.env, self.file_manager, self.stats, self)
 
-            sf_id = sf_pop.pop()
-            self.devices[dv_id].add_shared_folder(self.shared_folders[sf_id])
-            self.shared_folders[sf_id].add_device(self.devices[dv_id])
-
-        # then we complement the shared folder degree
-
-        # we skip devices with degree 1 in a first pass, since they just got 1 sf
-        r = 1
-
-        # we might have less edges leaving devices than necessary
-        while sf_pop:
-            # create the population of edges leaving devices
-            l = [i for i, j in enumerate(dv_dgr) for k in range(min(j - r, num_sf))]
-            random.shuffle(l)
-            dv_pop = deque(l)
-
-            # if we need to recreate the population, we use devices w/ degree 1 too
-            r = 0
-
-            while sf_pop and dv_pop:
-                dv = dv_pop.pop()
-                sf = sf_pop.pop()
-
-                # we are lazy and simply skip the unfortunate repetitions
-                if not self.shared_folders[sf] in self.devices[dv].my_shared_folders:
-                    self.devices[dv].add_shared_folder(self.shared_folders[sf])
-                    self.shared_folders[sf].add_device(self.devices[dv])
-                else:
-                    sf_pop.append(sf)
+        # then wire them, in a single pass over the edges
+        for dv, sf in zip(edge_dv.tolist(), edge_sf.tolist()):
+            self.devices[dv].add_shared_folder(self.shared_folders[sf])
+            self.shared_folders[sf].add_device(self.devices[dv])
 
     def look_for_peers(self, f):
         """
         Ritorna l'elenco di dispositivi attualmente loggati che hanno il file "f" di interesse
         """
+        if self.peer_index is not None:
+            return self.peer_index.look_for(f)
         sf = f.get_shared_folder()
         on_devices = filter(lambda d: d.is_on(), self.devices.values())
         return filter(lambda d: d.has_file(f) and d.has_shared_folder(sf), on_devices)
@@ -1,14 +1,27 @@
+import os
+import numpy
 import timed_structures as ts
-import qs_plots as plots
 import input_controls as ic
 
 
+# Numero massimo di campioni per serie nei grafici (vedi timed_structures.downsample)
+MAX_POINTS = 2000
+
+
 class StatsManager(object):
     """
     La classe modellizza un manager per le statistiche di un servizio di file sharing
     """
 
-    def __init__(self, n_devices, devices, env, server=True):
+    def __init__(self, n_devices, devices, env, server=True, load_bin_width=1, sink=None):
+        """
+        :param n_devices: numero di device della rete
+        :param devices: dizionario dei device, per id
+        :param env: ambiente di simulazione simpy
+        :param server: booleano, indica la presenza di un server centrale (False = P2P)
+        :param load_bin_width: ampiezza (s) degli intervalli su cui viene mediato il carico del server nei grafici
+        :param sink: crea le serie storiche (timed_structures.MemorySink o DiskSink; default: in memoria)
+        """
         # Server centrale per i download di files
         self.server = server
         # Ambiente di simulazione
@@ -23,27 +36,44 @@ class StatsManager(object):
         # Dati per le trasmissioni dati P2P
         self.current_p2p_exchanges = 0
         self.p2p_downloaded_data = 0.0
+        # Serie storiche, create in memoria o su disco a seconda di "sink"
+        if sink is None:
+            sink = ts.MemorySink()
         # Storico del numero di device attivi
-        self.online_devices = ts.TimedArray(empty=False)
-        self.downloading = ts.TimedArray(empty=False)
-        self.uploading = ts.TimedArray(empty=False)
+        self.online_devices = sink.series('online_devices', empty=False)
+        self.downloading = sink.series('downloading', empty=False)
+        self.uploading = sink.series('uploading', empty=False)
         # Storico del numero di conessioni P2P attive
-        self.p2p_downloading = ts.TimedArray(empty=False)
+        self.p2p_downloading = sink.series('p2p_downloading', empty=False)
         # Strico attivita' devices
-        self.online_for = ts.TimedArray(timestamp=False)
-        self.download_for = ts.TimedArray(timestamp=False)
-        self.download_for_success = ts.TimedArray(timestamp=False)
-        self.upload_for = ts.TimedArray(timestamp=False)
-        self.upload_for_success = ts.TimedArray(timestamp=False)
+        self.online_for = sink.series('online_for', timestamp=False)
+        self.download_for = sink.series('download_for', timestamp=False)
+        self.download_for_success = sink.series('download_for_success', timestamp=False)
+        self.upload_for = sink.series('upload_for', timestamp=False)
+        self.upload_for_success = sink.series('upload_for_success', timestamp=False)
         # Dati temporanei
-        self.pending_online = ts.TimedArray()
-        self.pending_download = ts.TimedArray()
-        self.pending_upload = ts.TimedArray()
-        # Carico sul server: l'indice del vettore coincide con il timestamp di simulazione -1
-        self.server_load_in = []
-        self.server_load_out = []
+        self.pending_online = ts.PendingIntervals()
+        self.pending_download = ts.PendingIntervals()
+        self.pending_upload = ts.PendingIntervals()
+        # Carico sul server: il secondo i-esimo di simulazione corrisponde all'intervallo [i - 1, i)
+        self.server_load_in = ts.StepSeries(load_bin_width,
+                                            sink.series('server_load_in', data_type=numpy.float64))
+        self.server_load_out = ts.StepSeries(load_bin_width,
+                                             sink.series('server_load_out', data_type=numpy.float64))
+        # Durata della simulazione
+        self.horizon = 0
+        # Transitorio iniziale escluso dalle medie di traffico e di dispositivi online, per serie ('in_traffic',
+        # 'out_traffic', 'online_devices'), e serie che non hanno raggiunto lo stato stazionario (vedi steady_state)
+        self.warmups = {}
+        self.unsettled = []
         self.server_downloaded_data = 0.0
 
+    def __getstate__(self):
+        # L'ambiente simpy viene ricreato al restore (vedi CloudEnvironment.load)
+        state = self.__dict__.copy()
+        state['env'] = None
+        return state
+
     def now(self):
         return int(self.env.now)
 
@@ -51,9 +81,13 @@ class StatsManager(object):
         """
         Nuova simulazione, la cui durata viene passata come parametro
         """
-        duration = until - len(self.server_load_in)
-        self.server_load_in += [0] * duration
-        self.server_load_out += [0] * duration
+        self.horizon = max(self.horizon, until)
+
+    def end_simulation(self, end):
+        """
+        La simulazione si ferma all'istante "end" (eventualmente prima della durata prevista)
+        """
+        self.horizon = end
 
     def login(self, d):
         """
@@ -66,7 +100,7 @@ class StatsManager(object):
         # Aggiorno il numero di dispositivi connessi nello storico dati
         self.online_devices.insert_or_update(t, self.current_online_devices)
         # Salvo l'informazione di login, per calcolare al momento del logout la durata della sessione
-        self.pending_online.append(ts.TimedData(d.id, t))
+        self.pending_online.open(d.id, t)
 
     def logout(self, d):
         """
@@ -79,13 +113,9 @@ class StatsManager(object):
         # Aggiorno il numero di dispositivi connessi nello storico daticurrent_uploading
         self.online_devices.insert_or_update(t, self.current_online_devices)
         # Ricavo la durata di sessione, partendo dal timestamp di login
-        x = self.pending_online.search_by_data(d.id)[0]
-        self.pending_online.remove(x)
-        t_login = x.get_time()
+        t_login = self.pending_online.close(d.id)
         session = t - t_login
-        self.online_for.append(
-            ts.TimedData(d.id, session, timestamp=False)
-        )
+        self.online_for.append(d.id, session)
 
     def download_start(self, d, f):
         """
@@ -98,7 +128,7 @@ class StatsManager(object):
         # Aggiorno il numero di download in parallelo nello storico dati
         self.downloading.insert_or_update(t, self.current_downloading)
         # Salvo l'informazione di download, per calcolare al suo termine la durata del trasferimento
-        self.pending_download.append(ts.TimedData(str(d.id) + '_' + str(f.get_id()), t))
+        self.pending_download.open((d.id, f.get_id()), t)
 
     def p2p_download_start(self):
         """
@@ -122,18 +152,11 @@ class StatsManager(object):
         # Aggiorno il numero di download in parallelo nello storico dati
         self.downloading.insert_or_update(t, self.current_downloading)
         # Ricavo la durata del trasferimento, partendo dal timestamp di inizio download
-        x = self.pending_download.search_by_data(str(d.id) + '_' + str(f.get_id()))[0]
-        self.pending_download.remove(x)
-        t_start = x.get_time()
+        t_start = self.pending_download.close((d.id, f.get_id()))
         dw_duration = t - t_start
-        self.download_for.append(
-            ts.TimedData(d.id + f.get_id(), dw_duration, timestamp=False)
-        )
+        self.download_for.append(d.id + f.get_id(), dw_duration)
         # Valori di carico sul server
-        i = t_start
-        while i <= t:
-            self.server_load_out[i - 1] += dw_rate
-            i += 1
+        self.server_load_out.add(max(t_start - 1, 0), t, dw_rate)
         self.server_downloaded_data += dw_duration * dw_rate
 
     def p2p_download_end(self, data_size):
@@ -160,7 +183,7 @@ class StatsManager(object):
         # Aggiorno il numero di upload in parallelo nello storico dati
         self.uploading.insert_or_update(t, self.current_uploading)
         # Salvo l'informazione di upload, per calcolare al suo termine la durata del trasferimento
-        self.pending_upload.append(ts.TimedData(d.id + f.get_id(), t))
+        self.pending_upload.open((d.id, f.get_id()), t)
 
     def p2p_upload_start(self):
         """
@@ -180,18 +203,11 @@ class StatsManager(object):
         # Aggiorno il numero di download in parallelo nello storico dati
         self.uploading.insert_or_update(t, self.current_uploading)
         # Ricavo la durata del trasferimento, partendo dal timestamp di inizio upload
-        x = self.pending_upload.search_by_data(d.id + f.get_id())[0]
-        self.pending_upload.remove(x)
-        t_login = x.get_time()
+        t_login = self.pending_upload.close((d.id, f.get_id()))
         session = t - t_login
-        self.upload_for.append(
-            ts.TimedData(d.id + f.get_id(), session, timestamp=False)
-        )
+        self.upload_for.append(d.id + f.get_id(), session)
         # Valori di carico sul server
-        i = t_login
-        while i <= t:
-            self.server_load_in[i - 1] += up_rate
-            i += 1
+        self.server_load_in.add(max(t_login - 1, 0), t, up_rate)
 
     def p2p_upload_end(self):
         # TODO: forse, questo metodo non serve, perche' le statistiche sono gia' elaborate in p2p_download_end
@@ -204,9 +220,7 @@ class StatsManager(object):
         :param f: file scaricato
         :param download_time: tempo di download
         """
-        self.download_for_success.append(
-            ts.TimedData(d.id + f.get_id(), download_time, timestamp=False)
-        )
+        self.download_for_success.append(d.id + f.get_id(), download_time)
 
     def upload_successful(self, d, f, upload_time):
         """
@@ -215,13 +229,15 @@ class StatsManager(object):
         :param f: file caricato
         :param upload_time: tempo di upload
         """
-        self.upload_for_success.append(
-            ts.TimedData(d.id + f.get_id(), upload_time, timestamp=False)
-        )
+        self.upload_for_success.append(d.id + f.get_id(), upload_time)
 
-    def stats(self):
+    def stats(self, plots=True, export_dir=None, max_points=MAX_POINTS):
         """
         Elabora statistiche finali e stampa a schermo dei grafici
+        :param plots: se False, vengono stampate solo le statistiche
+        :param export_dir: se specificata, i grafici vengono salvati come immagini PNG in questa cartella invece di
+            essere mostrati a schermo (backend Agg di matplotlib: non serve un display)
+        :param max_points: numero massimo di campioni per serie nei grafici (None: serie complete)
         """
         print '### STATS ###'
         print('Total number of devices in the network: %d' % self.n_devices)
@@ -248,87 +264,164 @@ class StatsManager(object):
         print('Average time spent by a device uploading data: %s s' % self.mean_uploading_time())
         print('Average download duration: %s s' % self.mean_download_time())
         print('Average upload duration: %s s' % self.mean_upload_time())
-        print('Average server incoming traffic: %s b/s' % self.mean_in_traffic())
-        print('Average server outgoing traffic: %s b/s' % self.mean_out_traffic())
+        print('Average number of online devices: %s%s' % (self.mean_online_devices(),
+                                                           self.warmup_note('online_devices')))
+        print('Average server incoming traffic: %s b/s%s' % (self.mean_in_traffic(), self.warmup_note('in_traffic')))
+        print('Average server outgoing traffic: %s b/s%s' % (self.mean_out_traffic(), self.warmup_note('out_traffic')))
+        if len(self.unsettled) > 0:
+            print('WARNING: steady state not reached by %s: no warm-up excluded from their averages' %
+                  ', '.join(self.unsettled))
+        if plots or export_dir is not None:
+            self.draw_plots(export_dir, max_points)
+
+    def draw_plots(self, export_dir=None, max_points=MAX_POINTS):
+        """
+        Disegna con matplotlib i grafici delle serie storiche, mostrandoli a schermo o salvandoli nella cartella
+        "export_dir" (backend Agg: non serve un display). matplotlib viene importato solo qui
+        """
+        import matplotlib
+        if export_dir is not None:
+            matplotlib.use('Agg')
+            if not os.path.isdir(export_dir):
+                os.makedirs(export_dir)
+        import matplotlib.pyplot as pyplot
         # Aggiorna i grafici
         t = self.now()
         self.online_devices.insert_or_update(t, self.current_online_devices)
         self.downloading.insert_or_update(t, self.current_downloading)
         self.uploading.insert_or_update(t, self.current_uploading)
+        # (nome del file, titolo, istanti, valori, etichetta dell'asse y, stile): le serie vengono lette a blocchi e
+        # ridotte a "max_points" campioni, per cui anche con un DiskSink restano in memoria solo i campioni ridotti
+        series = []
         # Dispositivi online
-        if len(self.online_devices.get_list()) > 2:
-            fig_online, area_online = plots.figure(title='Online devices')
-            plots.step_plot2(area_online, self.online_devices.get_time_list(), self.online_devices.get_data_list(),
-                             'Time', '#Devices')
+        if len(self.online_devices) > 2:
+            series.append(('online_devices', 'Online devices') +
+                          ts.series_downsample(self.online_devices, max_points) + ('#Devices', None))
         # Dispositivi in download
-        if len(self.downloading.get_list()) > 2:
-            fig_dw, area_dw = plots.figure(title='Devices downloading a file')
-            plots.step_plot2(area_dw, self.downloading.get_time_list(), self.downloading.get_data_list(), 'Time',
-                             '#Device', style='g')
+        if len(self.downloading) > 2:
+            series.append(('downloading', 'Devices downloading a file') +
+                          ts.series_downsample(self.downloading, max_points) + ('#Device', 'g'))
         # Dispositivi in upload
-        if len(self.uploading.get_list()) > 2:
-            fig_up, area_up = plots.figure(title='Devices uploading a file')
-            plots.step_plot2(area_up, self.uploading.get_time_list(), self.uploading.get_data_list(), 'Time',
-                             '#Device', style='r')
+        if len(self.uploading) > 2:
+            series.append(('uploading', 'Devices uploading a file') +
+                          ts.series_downsample(self.uploading, max_points) + ('#Device', 'r'))
         # Connessioni P2P
-        if (not self.server) and len(self.p2p_downloading.get_list()) > 2:
-            fig_p2p_dw, area_p2p_dw = plots.figure(title='P2P connections')
-            plots.step_plot2(area_p2p_dw, self.p2p_downloading.get_time_list(), self.p2p_downloading.get_data_list(),
-                             'Time', '#Connections', style='k')
-        # Traffico in ingresso al server
-        fig_in_traffic, area_in_traffic = plots.figure(title='Server incoming traffic')
-        plots.step_plot(area_in_traffic, self.server_load_in, 'Time', 'bit/s', style='m')
-        # Traffico in uscita dal server
-        fig_out_traffic, area_out_traffic = plots.figure(title='Server outgoing traffic')
-        plots.step_plot(area_out_traffic, self.server_load_out, 'Time', 'bit/s', style='y')
-        plots.show()
+        if (not self.server) and len(self.p2p_downloading) > 2:
+            series.append(('p2p_connections', 'P2P connections') +
+                          ts.series_downsample(self.p2p_downloading, max_points) + ('#Connections', 'k'))
+        # Traffico in ingresso e in uscita dal server: la serie densa ha un valore per ogni intervallo di
+        # "load_bin_width" secondi fino alla fine della simulazione, e viene ridotta una finestra alla volta
+        series.append(('server_in_traffic', 'Server incoming traffic') +
+                      self.server_load_in.downsample(self.horizon, max_points) + ('bit/s', 'm'))
+        series.append(('server_out_traffic', 'Server outgoing traffic') +
+                      self.server_load_out.downsample(self.horizon, max_points) + ('bit/s', 'y'))
+        for name, title, times, values, y_label, style in series:
+            fig, area = pyplot.subplots()
+            area.step(times, values, style or 'b', where='post')
+            area.set_title(title)
+            area.set_xlabel('Time')
+            area.set_ylabel(y_label)
+            area.grid(True)
+            if export_dir is not None:
+                fig.savefig(os.path.join(export_dir, name + '.png'))
+                pyplot.close(fig)
+        if export_dir is None:
+            pyplot.show()
+
+    def summary(self):
+        """
+        Ritorna un dizionario con le metriche riassuntive della simulazione (NaN se non disponibili)
+        """
+        total = self.p2p_downloaded_data + self.server_downloaded_data
+        return {
+            'server_downloaded_data': self.server_downloaded_data,
+            'p2p_downloaded_data': self.p2p_downloaded_data,
+            'p2p_share': self.p2p_downloaded_data / total if total > 0 else float('nan'),
+            'mean_downloading_time': to_number(self.mean_downloading_time()),
+            'mean_uploading_time': to_number(self.mean_uploading_time()),
+            'mean_download_time': to_number(self.mean_download_time()),
+            'mean_upload_time': to_number(self.mean_upload_time()),
+            'mean_in_traffic': to_number(self.mean_in_traffic()),
+            'mean_out_traffic': to_number(self.mean_out_traffic()),
+            'mean_online_devices': to_number(self.mean_online_devices()),
+            'warmup_in_traffic': self.warmup('in_traffic'),
+            'warmup_out_traffic': self.warmup('out_traffic'),
+            'warmup_online_devices': self.warmup('online_devices'),
+            'unsettled_series': len(self.unsettled),
+            'end_time': self.horizon,
+        }
+
+    def warmup(self, name):
+        """
+        Ritorna il transitorio iniziale (s) escluso dalla media della serie "name" (0 se non rilevato)
+        """
+        return self.warmups.get(name, 0)
+
+    def warmup_note(self, name):
+        """
+        Ritorna l'annotazione sul transitorio escluso dalla media della serie "name", per la stampa delle statistiche
+        """
+        if self.warmup(name) > 0:
+            return ' (warm-up of %d s excluded)' % self.warmup(name)
+        return ''
 
     def mean_downloading_time(self):
         """
         La funzione ritorna la media dei tempi medi spesi da ogni device per scaricare dati (con o senza successo)
         """
-        return reduce(lambda x, y: x + y, self.download_for.get_time_list(), 0.0) / self.n_devices
+        return float(ts.series_sum(self.download_for)) / self.n_devices
 
     def mean_uploading_time(self):
         """
         La funzione ritorna la media dei tempi medi spesi da ogni device per caricare dati (con o senza successo)
         """
-        return reduce(lambda x, y: x + y, self.upload_for.get_time_list(), 0.0) / self.n_devices
+        return float(ts.series_sum(self.upload_for)) / self.n_devices
 
     def mean_download_time(self):
         """
         La funzione ritorna la durata media di un download (con o senza successo)
         """
-        return mean(self.download_for_success.get_time_list())
+        return series_mean(self.download_for_success)
 
     def mean_upload_time(self):
         """
         La funzione ritorna la durata media di un upload (con o senza successo)
         """
-        return mean(self.upload_for_success.get_time_list())
+        return series_mean(self.upload_for_success)
 
     def mean_in_traffic(self):
         """
         La funzione ritorna il valor medio di traffico in ingresso al server (upload di file dei device)
         """
-        return mean(self.server_load_in)
+        return load_mean(self.server_load_in, self.horizon, self.warmup('in_traffic'))
 
     def mean_out_traffic(self):
         """
         La funzione ritorna il valor medio di traffico in ingresso al server (upload di file dei device)
         """
-        return mean(self.server_load_out)
+        return load_mean(self.server_load_out, self.horizon, self.warmup('out_traffic'))
+
+    def mean_online_devices(self):
+        """
+        La funzione ritorna il numero medio di dispositivi online, escluso il transitorio iniziale
+        """
+        warmup = self.warmup('online_devices')
+        if self.horizon <= warmup:
+            return 'N/A'
+        i_start, i_end = ts.series_step_integral(self.online_devices, [warmup, self.horizon])
+        return round((i_end - i_start) / (self.horizon - warmup), 2)
 
 
 def mean(array):
     """
-    Calcola la media di un vettore "array" di numeri
+    Calcola la media di un vettore "array" di numeri (lista o vettore NumPy)
     """
     # Controllo dell'input, tramite eccezioni
-    ic.check_array(array, 'array', of=(int, long, float))
+    if not isinstance(array, numpy.ndarray):
+        ic.check_array(array, 'array', of=(int, long, float))
     l = len(array)
     if l > 0:
-        s = reduce(lambda x, y: x + y, array)
+        s = numpy.sum(array, dtype=numpy.float64)
         m = round(s / l, 2)
     else:
         m = 'N/A'
@@ -336,6 +429,37 @@ def mean(array):
     return m
 
 
+def series_mean(array):
+    """
+    Calcola la media dei campi "time" di un CompactTimedArray o SpillingTimedArray, letti a blocchi
+    """
+    if len(array) > 0:
+        m = round(float(ts.series_sum(array)) / len(array), 2)
+    else:
+        m = 'N/A'
+    return m
+
+
+def to_number(value):
+    """
+    Converte il risultato di una media in float: i valori non disponibili ('N/A') diventano NaN
+    """
+    if isinstance(value, str):
+        return float('nan')
+    return float(value)
+
+
+def load_mean(series, end_time, start_time=0):
+    """
+    Calcola il valor medio di una serie di carico "series" (StepSeries) nell'intervallo [start_time, end_time)
+    """
+    if end_time > start_time:
+        m = round(series.mean(start_time, end_time), 2)
+    else:
+        m = 'N/A'
+    return m
+
+
 def integral_mean(t_array, end_time):
     """
     Calcola la media integrale di un TimedArray "tArray" (peso i valori "data" a seconda dell'intervallo "time" a 
@@ -345,28 +469,21 @@ def integral_mean(t_array, end_time):
     # Controllo dell'input
     try:
         ic.check_timed_array(t_array, 'tArray')
+        times = numpy.asarray(t_array.get_time_list(), dtype=numpy.float64)
+        values = numpy.asarray(t_array.get_data_list(), dtype=numpy.float64)
         s = 0.0
-        total_time = 0.0
         prev_time = 0.0
         prev_value = 0.0
-        val = 0.0
-        has_intervals = t_array.has_time_intervals()
-        for x in t_array.get_list():
-            # Ricavo i campi dell'elemento in analisi
-            t = x.get_time()
-            d = x.get_data()
-            # Il vettore puo' contenere intervalli o timestamp
-            # Nel secondo caso, devo computare l'intervallo di tempo trascorso
-            if not has_intervals:
-                time_interval = t - prev_time
-                val = prev_value
-                prev_time = float(t)
-                prev_value = d
-            else:
-                time_interval = t
-            # Quindi, aggiorno i valori di somma e tempo totale
-            total_time += time_interval
-            s += val * time_interval
+        if len(times) == 0:
+            total_time = 0.0
+        elif not t_array.has_time_intervals():
+            # Il vettore contiene timestamp: ogni valore vale fino al timestamp successivo
+            total_time = times[-1]
+            s = float(numpy.dot(values[:-1], numpy.diff(times)))
+            prev_time = times[-1]
+            prev_value = values[-1]
+        else:
+            total_time = float(times.sum())
         # Ultimo dato
         total_time += end_time - prev_time
         s += prev_value * (end_time - prev_time)
@@ -383,8 +500,7 @@ def time_mean_per_data(array, n_data):
     :param array: vettore TimedArray da cui calcolare la media
     :param n_data: numero di valori data in esso contenuti
     """
-    s = 0.0
-    for i in range(n_data):
-        s += reduce(lambda x, y: x + y, map(lambda x: x.get_time(), filter(lambda x: x.get_data() == i,
-                                                                           array.get_list())), 0)
+    times = numpy.asarray(array.get_time_list(), dtype=numpy.float64)
+    data = numpy.asarray(array.get_data_list())
+    s = times[numpy.in1d(data, numpy.arange(n_data))].sum()
     return s / n_data
@@ -1,28 +1,56 @@
+import math
 import random
-import numpy
-import simpy
+from collections import deque
+import my_logger
+import samplers
 from file_manager import SharedFile
+from missing_files import MissingFiles
+
+
+# Generatori di variabili aleatorie, estratte a blocchi
+INTER_SESSION_TIMES = samplers.lognormal(mean=7.971, sigma=1.308)
+SESSION_DURATIONS = samplers.lognormal(mean=8.492, sigma=1.545)
+INTER_UPLOAD_TIMES = samplers.lognormal(mean=3.748, sigma=2.286)
+RATE_VARIATIONS = samplers.uniform()
+
+# Stati del dispositivo: in ciascuno, il dispositivo attende lo scadere del proprio timer ("wake_at")
+OFFLINE = 0
+P2P_DOWNLOAD = 1
+DOWNLOAD = 2
+DOWNLOAD_FAILED = 3
+INTER_UPLOAD = 4
+UPLOAD = 5
+UPLOAD_FAILED = 6
+NO_UPLOAD_TIME = 7
+# Il dispositivo non torna piu' online (download interrotto dal logout)
+STOPPED = 8
+
+# Stati del processo dei download al volo (None = processo terminato)
+LIVE_IDLE = 0
+LIVE_WAKING = 1
+LIVE_DOWNLOAD = 2
+LIVE_DOWNLOAD_FAILED = 3
 
 
 def new_inter_session_time():
     """
     Ritorna un valore per l'istanza di "inter-session time"
     """
-    return numpy.random.lognormal(mean=7.971, sigma=1.308)
+    return INTER_SESSION_TIMES.get()
 
 
 def new_session_duration():
     """
     Ritorna un valore per l'istanza di "session time"
     """
-    return numpy.random.lognormal(mean=8.492, sigma=1.545)
+    return SESSION_DURATIONS.get()
 
 
 def new_inter_upload_time():
     """
     Ritorna un valore per l'istanza di "inter-upload time"
     """
-    return numpy.random.lognormal(mean=3.748, sigma=2.286)
+    return INTER_UPLOAD_TIMES.get()
 
 
 def new_download_time(s, download_rate):
@@ -40,7 +68,7 @@ def new_download_rate(f):
     Ritorna un valore per l'istanza di "download rate", relativa al file "f"
     """
     r = f.get_throughput()
-    delta_r = (random.random() - 0.25) * 2 * r
+    delta_r = (RATE_VARIATIONS.get() - 0.25) * 2 * r
     r += delta_r
     return r
 
@@ -59,7 +87,60 @@ def new_upload_rate(f):
     return new_download_rate(f)
 
 
+def round_robin_allocation(file_size, residual_times, rates):
+    """
+    Ripartisce il download di un file tra piu' peers: ad ogni secondo, ogni peer con tempo residuo positivo invia
+    "rates[i]" bit (nell'ordine in cui compare), finche' il file non e' completo o i peers non hanno piu' tempo.
+    I secondi in cui nessun peer completa il file vengono calcolati per fasi, ordinando i peers per tempo residuo
+    :param file_size: dimensione del file (bit)
+    :param residual_times: tempo a disposizione di ciascun peer (s)
+    :param rates: velocita' di trasferimento di ciascun peer (bit/s)
+    :return: tupla (secondi di connessione per peer, bit scaricati, True se il file e' stato scaricato interamente)
+    """
+    k = len(rates)
+    # Numero di secondi che ciascun peer puo' dedicare al trasferimento
+    slots = [int(math.ceil(t)) if t > 0 else 0 for t in residual_times]
+    # Secondi interi, trascorsi senza completare il file, in cui trasmettono tutti i peers ancora attivi
+    elapsed = 0
+    data = 0.0
+    active_rate = sum([rates[i] for i in range(k) if slots[i] > 0])
+    for i in sorted(range(k), key=lambda x: slots[x]):
+        if slots[i] > elapsed:
+            phase = slots[i] - elapsed
+            if data + active_rate * phase >= file_size:
+                # Il file viene completato in questa fase
+                if file_size > data:
+                    elapsed += max(int(math.ceil((file_size - data) / active_rate)) - 1, 0)
+                break
+            data += active_rate * phase
+            elapsed = slots[i]
+        if slots[i] > 0:
+            active_rate -= rates[i]
+    durations = [min(s, elapsed) for s in slots]
+    downloaded_data = sum([rates[i] * durations[i] for i in range(k)], 0.0)
+    # Ultimi secondi: i peers trasmettono a turno fino al completamento del file
+    residual = [slots[i] - durations[i] for i in range(k)]
+    downloaded = False
+    while (not downloaded) and max(residual + [0]) > 0:
+        for i in range(k):
+            if residual[i] > 0:
+                residual[i] -= 1
+                durations[i] += 1
+                downloaded_data += rates[i]
+                if downloaded_data >= file_size:
+                    downloaded = True
+                    break
+    return durations, downloaded_data, downloaded
+
+
 class Device(object):
+    # Attributi fissi, senza __dict__ per istanza: a milioni di dispositivi la memoria si riduce sensibilmente
+    __slots__ = ('id', 'my_shared_folders', 'env', 'cloud_env', 'fm', 'stats', 'current_sf', 'end_session',
+                 'logged_in', 'missing_files', 'missed_uploads', 'triggered_list', 'triggerable', 'p2p_uploaded',
+                 'p2p_uploads', 'p2p_downloads', 'state', 'wake_at', 'timer', 'session_duration', 'residual_time',
+                 'transfer', 'transfer_size', 'transfer_rate', 'transfer_time', 'p2p_result', 'live_state',
+                 'live_file', 'live_rate', 'live_time', 'live_wake_at', 'live_timer')
+
     # cosftructor
     def __init__(self, device_id, env, fm, cs, cenv):
         """
@@ -87,20 +168,53 @@ class Device(object):
         # Flag di login
         self.logged_in = False
         # Elenco dei file obsoleti/mancanti, da scaricare
-        self.missing_files = set([])
-        # Elenco dei file che non sono stati caricati in upload
-        self.missed_uploads = set([])
-        # Elenco dei file da scaricare al volo
-        self.triggered_list = set([])
-        # Risorsa condivisa per i triggered download: utile per scaricare i file al volo
-        self.trigger_lock = simpy.Container(self.env, init=0)
+        self.missing_files = MissingFiles()
+        # Elenco dei file che non sono stati caricati in upload, ed elenco dei file da scaricare al volo: come i
+        # trasferimenti P2P in corso, vengono creati al primo login (molti dispositivi non vanno mai online)
+        self.missed_uploads = None
+        self.triggered_list = None
         # Flag: se vero, il dispositivo viene notificato realtime sull'upload di nuovi file su Cloud
         self.triggerable = False
-        # Contributo nel trasferimento file P2P
-        self.p2p_contribution = 0.0
+        # Contributo nel trasferimento file P2P: bit inviati con upload conclusi e upload in corso
+        # (inizio, rate, durata, timer)
+        self.p2p_uploaded = 0.0
+        self.p2p_uploads = None
+        # Porzioni di file in download dai peers (file, rate, durata, id del peer, inizio, timer)
+        self.p2p_downloads = None
+        # Stato corrente, istante e numero d'ordine del timer che lo conclude
+        self.state = OFFLINE
+        self.wake_at = 0
+        self.timer = None
+        # Dati della sessione corrente: durata e tempo residuo
+        self.session_duration = 0
+        self.residual_time = 0
+        # Trasferimento in corso: file, bit da trasferire, rate e durata
+        self.transfer = None
+        self.transfer_size = 0
+        self.transfer_rate = 0
+        self.transfer_time = 0
+        # Esito del download P2P in corso: (bit scaricati, True se il file e' completo)
+        self.p2p_result = None
+        # Processo dei download al volo: stato, download in corso e timer
+        self.live_state = None
+        self.live_file = None
+        self.live_rate = 0
+        self.live_time = 0
+        self.live_wake_at = 0
+        self.live_timer = None
         # Preparazione alla simulazione
         self.prepare()
 
+    def __getstate__(self):
+        # L'ambiente simpy non viene salvato: al restore i timer vengono ricreati da "timers"
+        state = dict((name, getattr(self, name)) for name in self.__slots__)
+        state['env'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
     # fancy printing as string
     def __str__(self):
         sf_str = ", ".join([str(i) for i in self.my_shared_folders])
@@ -110,6 +224,19 @@ class Device(object):
     def add_shared_folder(self, sf):
         self.my_shared_folders.append(sf)
 
+    @property
+    def p2p_contribution(self):
+        """
+        Bit inviati ai peers fino all'istante corrente: degli upload in corso vengono contati i secondi interi trascorsi
+        """
+        contribution = self.p2p_uploaded
+        if self.p2p_uploads is None:
+            return contribution
+        now = self.env.now
+        for start, rate, duration, _ in self.p2p_uploads:
+            contribution += rate * min(duration, int(now - start))
+        return contribution
+
     def is_working_in_sf(self, sf):
         """
         Verifica che il dispositivo stia lavorando nella cartella condivisa specificata
@@ -151,212 +278,284 @@ class Device(object):
 
     def prepare(self):
         """
-        La funzione prepara i processi di simulazione per il dispositivo in questione
+        La funzione prepara la simulazione per il dispositivo in questione: il primo login avviene dopo un tempo di
+        attesa
+        """
+        self.state = OFFLINE
+        self.wait(new_inter_session_time())
+
+    def wait(self, delay):
+        """
+        Il dispositivo resta nello stato corrente per "delay" secondi, poi prosegue con "step"
         """
-        self.env.process(self.run())
+        self.wake_at = self.env.now + delay
+        self.timer = self.cloud_env.next_timer()
+        self.cloud_env.start_timer(delay, self.step)
 
-    def run(self):
+    def timers(self):
         """
-        Questo metodo alterna lo stato di online/offline per il device
+        Ritorna i timer in sospeso del dispositivo, come tuple (istante, numero d'ordine, funzione, argomenti): servono
+        a ricreare gli eventi dopo un restore
         """
-        while True:
-            # Tempo di attesa, prima di diventare online
-            inter_session_time = new_inter_session_time()
-            yield self.env.timeout(inter_session_time)
-            # Scelgo la shared folder su cui operare in questa sessione
-            self.current_sf = self.random_sf()
-            # Il device effettua il login
-            session_duration = new_session_duration()
-            # La sessione ha una durata massima, entro cui posso svolgere le operazioni: quando session_duration ha
-            # valore negativo, significa che l'operazione corrente di upload/download viene troncata
-            self.session_start(session_duration)
+        timers = []
+        if self.state != STOPPED:
+            timers.append((self.wake_at, self.timer, self.step, ()))
+        if self.live_state in (LIVE_WAKING, LIVE_DOWNLOAD, LIVE_DOWNLOAD_FAILED):
+            timers.append((self.live_wake_at, self.live_timer, self.live_step, ()))
+        for upload in self.p2p_uploads or ():
+            timers.append((upload[0] + upload[2], upload[3], self.p2p_upload_end, (upload,)))
+        for download in self.p2p_downloads or ():
+            timers.append((download[4] + download[2], download[5], self.p2p_download_end, (download,)))
+        return timers
 
-            # DOWNLOADS
-            residual_time = session_duration
-            # Ricaviamo l'elenco dei file che dovrei scaricare
-            if len(self.downloads()) == 0:
-                self.fm.log('Device %d has no file to download from the server' % self.id)
+    def step(self):
+        """
+        Questo metodo alterna lo stato di online/offline per il device: allo scadere del timer conclude l'attivita' dello
+        stato corrente e prosegue fino alla prossima attesa
+        """
+        state = self.state
+        if state == OFFLINE:
+            self.new_session()
+        elif state == P2P_DOWNLOAD:
+            if self.p2p_transfer_done():
+                self.next_download()
             else:
-                while len(self.downloads()) > 0:
-                    # File da scaricare
-                    f = self.downloads().pop()
-                    file_size_to_download = f.get_size()
-                    server_download = True
-                    # Verifico il download P2P
-                    if not self.cloud_env.server:
-                        server_download = False
-                        # Elenco dei dispositivi loggati che dispongono del file
-                        peers = self.cloud_env.look_for_peers(f)
-                        if len(peers) > 0:
-                            # Ricavo le durate utili residue relative alle sessioni dei peers
-                            residual_times = map(lambda p: min(p.residual_session_duration(), residual_time), peers)
-                            # Calcolo un valore di throughput per il trasferimento dati del file dai vari peers
-                            rates = map(lambda p: new_download_rate(f), peers)
-
-                            # Funzione locale, verifica se ho tempo a disposizione per scaricare il file da altri peers
-                            def p2p_check():
-                                for t in residual_times:
-                                    if t > 0:
-                                        return True
-                                return False
-
-                            # Calcolo ora per quanto tempo rimanere connesso ai vari peers, per scaricare il file
-                            durations = [0] * len(peers)
-                            downloaded_data = 0.0
-                            file_size = f.get_size()
-                            downloaded = False
-                            while (not downloaded) and p2p_check():
-                                for i in range(len(peers)):
-                                    if residual_times[i] > 0:
-                                        # Scarichero' un secondo di dati dal peer i-esimo
-                                        residual_times[i] -= 1
-                                        durations[i] += 1
-                                        downloaded_data += rates[i]
-                                        # Se il file puo' essere scaricato, interrompo i cicli
-                                        if downloaded_data >= file_size:
-                                            downloaded = True
-                                            break
-                            # Eseguo il download in parallelo dai vari peers
-                            events = []
-                            for i in range(len(peers)):
-                                if durations[i] > 0:
-                                    events.append(self.env.process(peers[i].p2p_upload(f, durations[i], rates[i])))
-                                    self.env.process(self.p2p_download(f, durations[i], rates[i], peers[i].get_id()))
-                            if len(events) > 0:
-                                yield simpy.events.AllOf(self.env, events)
-                            # Terminato il download dai peer, se il file e' troppo grande la parte residua viene
-                            # scaricata dal server centrale
-                            if not downloaded:
-                                file_size_to_download -= downloaded_data
-                                server_download = True
-                            else:
-                                self.missing_files.remove(f)
-                        else:
-                            # Non ci sono peer che dispongono del file che sto cercando
-                            server_download = True
-                    if server_download:
-                        # Devo scaricare il file da server
-                        # Tempo richiesto per il download del file
-                        server_download_rate = new_download_rate(f)
-                        server_download_time = new_download_time(file_size_to_download, server_download_rate)
-                        residual_time -= server_download_time
-                        # Verifico di avere tempo sufficiente per eseguire correttamente il download del file
-                        if residual_time >= 0:
-                            # Riesco a scaricare correttamente il file
-                            yield self.env.process(self.download(f, server_download_time, server_download_rate, True))
-                        else:
-                            # L'operazione di download e' stata prematuramente interrotta
-                            self.missing_files.add(f)
-                            self.stats.download_start(self, f)
-                            yield self.env.timeout(residual_time + server_download_time)
-                            self.stats.download_end(self, f, server_download_rate)
-                            self.fm.log('Device %s fails to download on fly file "%d" at %d' % (self.id, f.get_id(),
-                                                                                         int(self.env.now)))
-                            return
-                self.fm.log('Device %s finishes its downloads at %d' % (self.id, int(self.env.now)))
-            # Nell'eventuale parte rimanente della sessione, il dispositivo effettua upload di file e scarica le nuove
-            # modifiche
-            if residual_time > 0:
-                # TRIGGERED DOWNLOADS
-                # In parallelo agli uploads, il dispositivo rimane in ascolto per scaricare file caricati da altri sulla
-                # cartella condivisa corrente
-                self.triggerable = True
-                # UPLOADS
-                # Se la parte di download e' terminata con successo, procedo nel caricare in upload piu' file possibile
-                yield self.env.process(self.uploads(residual_time))
-                '''tdw_proc = self.env.process(self.triggered_downloads(residual_time))
-                yield up_proc or tdw_proc'''
-                self.triggerable = False
-                # up_proc.interrupt('')
-                # tdw_proc.interrupt('')
-            self.session_end()
-            self.fm.log('Device %d logs out at %d: session lasts for %d' % (self.id, int(self.env.now),
-                                                                            int(session_duration)))
-
-    def downloads(self):
-        """
-        La funzione restituisce l'elenco di file da scaricare (perche' nuovi o modificati) da una specifica cartella
-        condivisa
-        """
-        return filter(lambda x: x.get_shared_folder() == self.current_sf, self.missing_files)
-
-    def download(self, f, download_time, download_rate, on_fly=False):
-        """
-        La funzione simula il download del file "f"
-        """
-        # Eseguo il download del file, che puo' essere server o P2P
-        self.stats.download_start(self, f)
-        yield self.env.timeout(download_time)
+                self.server_download()
+        elif state == DOWNLOAD:
+            self.download_done(self.transfer, self.transfer_time, self.transfer_rate, True)
+            self.next_download()
+        elif state == DOWNLOAD_FAILED:
+            # L'operazione di download e' stata prematuramente interrotta: il dispositivo non torna piu' online
+            self.stats.download_end(self, self.transfer, self.transfer_rate)
+            if self.fm.logging:
+                self.fm.log_event(my_logger.DOWNLOAD_FAILED, self.env.now, self.id, self.transfer.get_id())
+            self.state = STOPPED
+        elif state == INTER_UPLOAD:
+            self.upload_start()
+        elif state == UPLOAD:
+            self.upload_done(self.transfer, self.transfer_time, self.transfer_rate)
+            self.residual_time -= self.transfer_time
+            self.next_upload()
+        elif state == UPLOAD_FAILED:
+            # L'operazione di upload viene interrotta prematuramente a causa del logout
+            self.stats.upload_end(self, self.transfer, self.transfer_rate)
+            if self.fm.logging:
+                self.fm.log_event(my_logger.UPLOAD_FAILED, self.env.now, self.id, self.transfer.get_id())
+            self.residual_time = 0
+            self.next_upload()
+        elif state == NO_UPLOAD_TIME:
+            if self.fm.logging:
+                self.fm.log_event(my_logger.NO_UPLOAD_TIME, self.env.now, self.id)
+            self.residual_time = 0
+            self.next_upload()
+
+    def new_session(self):
+        """
+        Il device effettua il login e inizia a scaricare i file mancanti
+        """
+        # Scelgo la shared folder su cui operare in questa sessione
+        self.current_sf = self.random_sf()
+        # La sessione ha una durata massima, entro cui posso svolgere le operazioni: quando il tempo residuo ha
+        # valore negativo, significa che l'operazione corrente di upload/download viene troncata
+        self.session_duration = new_session_duration()
+        self.session_start(self.session_duration)
+        # DOWNLOADS
+        self.residual_time = self.session_duration
+        if self.missing_files.count(self.current_sf) == 0:
+            if self.fm.logging:
+                self.fm.log_event(my_logger.NO_DOWNLOADS, self.env.now, self.id)
+            self.downloads_done()
+        else:
+            self.next_download()
+
+    def next_download(self):
+        """
+        Avvia il download del prossimo file mancante della cartella condivisa corrente, dai peers o dal server
+        """
+        while self.missing_files.count(self.current_sf) > 0:
+            # File da scaricare
+            f = self.missing_files.last(self.current_sf)
+            self.transfer = f
+            self.transfer_size = f.get_size()
+            # Verifico il download P2P
+            if not self.cloud_env.server:
+                # Elenco dei dispositivi loggati che dispongono del file
+                peers = self.cloud_env.look_for_peers(f)
+                if len(peers) > 0:
+                    # Ricavo le durate utili residue relative alle sessioni dei peers
+                    residual_times = map(lambda p: min(p.residual_session_duration(), self.residual_time), peers)
+                    # Calcolo un valore di throughput per il trasferimento dati del file dai vari peers
+                    rates = map(lambda p: new_download_rate(f), peers)
+                    # Calcolo ora per quanto tempo rimanere connesso ai vari peers, per scaricare il file
+                    durations, downloaded_data, downloaded = self.cloud_env.p2p_policy(
+                        f.get_size(), residual_times, rates)
+                    self.p2p_result = (downloaded_data, downloaded)
+                    # Eseguo il download in parallelo dai vari peers, e attendo che terminino tutti
+                    duration = 0
+                    for i in range(len(peers)):
+                        if durations[i] > 0:
+                            peers[i].p2p_upload(f, durations[i], rates[i])
+                            self.p2p_download(f, durations[i], rates[i], peers[i].get_id())
+                            duration = max(duration, durations[i])
+                    if duration > 0:
+                        self.state = P2P_DOWNLOAD
+                        self.wait(duration)
+                        return
+                    if self.p2p_transfer_done():
+                        continue
+            self.server_download()
+            return
+        if self.fm.logging:
+            self.fm.log_event(my_logger.DOWNLOADS_DONE, self.env.now, self.id)
+        self.downloads_done()
+
+    def p2p_transfer_done(self):
+        """
+        Terminato il download dai peer, ritorna True se il file e' stato scaricato interamente: altrimenti la parte
+        residua dovra' essere scaricata dal server centrale
+        """
+        downloaded_data, downloaded = self.p2p_result
+        self.p2p_result = None
+        if not downloaded:
+            self.transfer_size -= downloaded_data
+            return False
+        if self.missing_files.remove(self.transfer):
+            self.update_peer_index(self.transfer)
+        return True
+
+    def server_download(self):
+        """
+        Avvia il download del file corrente dal server, troncandolo se la sessione non e' abbastanza lunga
+        """
+        f = self.transfer
+        # Tempo richiesto per il download del file
+        self.transfer_rate = new_download_rate(f)
+        self.transfer_time = new_download_time(self.transfer_size, self.transfer_rate)
+        self.residual_time -= self.transfer_time
+        # Verifico di avere tempo sufficiente per eseguire correttamente il download del file
+        if self.residual_time >= 0:
+            self.stats.download_start(self, f)
+            self.state = DOWNLOAD
+            self.wait(self.transfer_time)
+        else:
+            self.missing_files.add(f)
+            self.stats.download_start(self, f)
+            self.state = DOWNLOAD_FAILED
+            self.wait(self.residual_time + self.transfer_time)
+
+    def downloads_done(self):
+        """
+        Nell'eventuale parte rimanente della sessione, il dispositivo effettua upload di file e scarica le nuove
+        modifiche
+        """
+        if self.residual_time > 0:
+            # TRIGGERED DOWNLOADS
+            # In parallelo agli uploads, il dispositivo rimane in ascolto per scaricare file caricati da altri sulla
+            # cartella condivisa corrente
+            self.triggerable = True
+            if self.live_state is None:
+                self.live_state = LIVE_IDLE
+                self.next_live_download()
+            # UPLOADS
+            self.next_upload()
+        else:
+            self.logout()
+
+    def logout(self):
+        """
+        Il device effettua il logout e attende la sessione successiva
+        """
+        self.triggerable = False
+        self.session_end()
+        if self.fm.logging:
+            self.fm.log_event(my_logger.LOGOUT, self.env.now, self.id, duration=self.session_duration)
+        self.state = OFFLINE
+        self.wait(new_inter_session_time())
+
+    def download_done(self, f, download_time, download_rate, on_fly=False):
+        """
+        La funzione conclude il download del file "f", dal server
+        """
         self.stats.download_end(self, f, download_rate)
         self.stats.download_successful(self, f, download_time)
-        # Ho scaricato il file, quindi lo segnalo come aggiornato
-        self.missing_files.remove(f)
-        self.fm.log(
-            'Device %d downloads %sfile "%d" from the server at %d: download lasts for %.2f' %
-            (self.id, 'on fly ' if on_fly else '', f.get_id(), int(self.env.now), download_time)
-        )
+        # Ho scaricato il file, quindi lo segnalo come aggiornato (a meno che nel frattempo non ne sia stata notificata
+        # una nuova versione)
+        if self.missing_files.remove(f):
+            self.update_peer_index(f)
+        if self.fm.logging:
+            self.fm.log_event(my_logger.DOWNLOAD_ON_FLY if on_fly else my_logger.DOWNLOAD, self.env.now, self.id,
+                              f.get_id(), duration=download_time)
 
     def p2p_download(self, f, download_time, download_rate, peer_id):
         """
-        La funzione simula il download di una porzione di file da un peer
+        La funzione avvia il download di una porzione di file da un peer
         :param f: file scaricato
         :param download_time: tempo impiegato per scaricare la porzione di file (s)
         :param download_rate: velcoita' di download (bit/s)
         :param peer_id: id del peer che effettua l'upload dei dati
         """
-        size = download_time * download_rate
         self.stats.p2p_download_start()
-        yield self.env.timeout(download_time)
+        download = (f, download_rate, download_time, peer_id, self.env.now, self.cloud_env.next_timer())
+        self.p2p_downloads.append(download)
+        self.cloud_env.start_timer(download_time, self.p2p_download_end, download)
+
+    def p2p_download_end(self, download):
+        """
+        La funzione conclude il download di una porzione di file da un peer
+        """
+        self.p2p_downloads.remove(download)
+        f, download_rate, download_time, peer_id = download[:4]
+        size = download_time * download_rate
         self.stats.p2p_download_end(size)
-        if f.get_size() == size:
-            # Sto scaricando l'intero file da un unico peer
-            tmp = 'the entire'
+        if self.fm.logging:
+            if f.get_size() == size:
+                # Sto scaricando l'intero file da un unico peer
+                kind = my_logger.P2P_DOWNLOAD
+            else:
+                kind = my_logger.P2P_PARTIAL_DOWNLOAD
+            self.fm.log_event(kind, self.env.now, self.id, f.get_id(), peer=peer_id, size=size, duration=download_time)
+
+    def next_upload(self):
+        """
+        La funzione prepara, per il tempo di sessione rimasto, il prossimo upload sulla cartella condivisa
+        """
+        if self.residual_time <= 0:
+            self.logout()
+            return
+        # Verifico che l'upload possa avere luogo
+        inter_upload_time = new_inter_upload_time()
+        if self.fm.logging:
+            self.fm.log_event(my_logger.INTER_UPLOAD, self.env.now, self.id, duration=inter_upload_time)
+        # File da mandare in upload
+        f = self.to_upload()
+        self.transfer = f
+        if inter_upload_time >= self.residual_time:
+            # Non riesco a fare altri uploads (una versione precedente dello stesso file viene sostituita)
+            self.missed_uploads.discard(f)
+            self.missed_uploads.add(f)
+            self.state = NO_UPLOAD_TIME
+            self.wait(self.residual_time)
         else:
-            tmp = 'a portion of'
-        self.fm.log('Device %d downloads %s file "%d" (size: %.2f bits) from the peer "%d" at %d: download '
-                    'lasts for %.2f' % (self.id, tmp, f.get_id(), size, peer_id, int(self.env.now), download_time))
-
-    def uploads(self, residual_time):
-        """
-        La funzione esegue, per il tempo rimasto, l'upload di piu' file possibile sulla cartella condivisa
-        - "residual_time" e' il tempo di sessione rimasto
-        """
-        try:
-            while residual_time > 0:
-                # Verifico che l'upload possa avere luogo
-                inter_upload_time = new_inter_upload_time()
-                self.fm.log('Device %s starts waiting an inter-upload time of %d at %s' % (self.id, inter_upload_time,
-                                                                                           int(self.env.now)))
-                # File da mandare in upload
-                f = self.to_upload()
-                if inter_upload_time >= residual_time:
-                    # Non riesco a fare altri uploads
-                    self.missed_uploads.add(f)
-                    yield self.env.timeout(residual_time)
-                    self.fm.log('Device %s has no time to upload file (inter-upload time) at %s' % (self.id,
-                                                                                                    int(self.env.now)))
-                    residual_time = 0
-                else:
-                    # Posso tentare un nuovo upload
-                    yield self.env.timeout(inter_upload_time)
-                    residual_time -= inter_upload_time
-                    # UPLOAD
-                    upload_rate = new_upload_rate(f)
-                    upload_time = new_upload_time(f.get_size(), upload_rate)
-                    if residual_time >= upload_time:
-                        # Posso effettuare correttamente l'upload del file
-                        yield self.env.process(self.upload(f, upload_time, upload_rate))
-                        residual_time -= upload_time
-                    else:
-                        # L'operazione di upload viene interrotta prematuramente a causa del logout
-                        self.stats.upload_start(self, f)
-                        yield self.env.timeout(residual_time)
-                        self.stats.upload_end(self, f, upload_rate)
-                        self.fm.log(
-                            'Device %s fails to upload file "%s" at %s' % (self.id, f.get_id(), int(self.env.now)))
-                        residual_time = 0
-        except simpy.Interrupt:
-            pass
+            # Posso tentare un nuovo upload
+            self.residual_time -= inter_upload_time
+            self.state = INTER_UPLOAD
+            self.wait(inter_upload_time)
+
+    def upload_start(self):
+        """
+        La funzione avvia l'upload del file corrente, troncandolo se la sessione non e' abbastanza lunga
+        """
+        f = self.transfer
+        self.transfer_rate = new_upload_rate(f)
+        self.transfer_time = new_upload_time(f.get_size(), self.transfer_rate)
+        self.stats.upload_start(self, f)
+        if self.residual_time >= self.transfer_time:
+            # Posso effettuare correttamente l'upload del file
+            self.state = UPLOAD
+            self.wait(self.transfer_time)
+        else:
+            self.state = UPLOAD_FAILED
+            self.wait(self.residual_time)
 
     def to_upload(self):
         """
@@ -364,7 +563,7 @@ class Device(object):
         prematuro, allora gli altri device che condividono la cartella riceveranno questo file
         """
         # Per prima cosa, guardo i file che non sono riuscito a caricare in precedenza
-        for x in self.missed_uploads:
+        for x in list(self.missed_uploads):
             # Mi soffermo sulla cartella condivisa su cui il device opera in questa sua sessione
             if x.get_shared_folder() == self.current_sf:
                 if self.current_sf.has_file(x):
@@ -384,90 +583,106 @@ class Device(object):
         t = int(self.env.now)
         return SharedFile.from_cloud(fc, self.current_sf, t, self.id)
 
-    def upload(self, f, upload_time, upload_rate):
+    def upload_done(self, f, upload_time, upload_rate):
         """
-        La funzione simula l'upload del file "f" su server, di durata "upload_time" e rate "upload_rate"
-        :param f: file da mandare in upload
+        La funzione conclude l'upload del file "f" su server, di durata "upload_time" e rate "upload_rate"
+        :param f: file mandato in upload
         :param upload_time: durata del trasferimento dati
         :param upload_rate: velocita' di trasferimento dei dati
         """
-        # Eseguo l'upload del file
-        self.stats.upload_start(self, f)
-        yield self.env.timeout(upload_time)
         # Aggiorna i riferimenti su cartella condivisa e notifica gli altri device
         sf = f.get_shared_folder()
         sf.upload_file(f, int(self.env.now))
+        self.update_peer_index(f)
         self.stats.upload_end(self, f, upload_rate)
         self.stats.upload_successful(self, f, upload_time)
-        self.fm.log(
-            'Device %d uploads file "%d" in shared folder "%d", at %d: upload lasts for %.2f' %
-            (self.id, f.get_id(), sf.get_id(), int(self.env.now), int(upload_time))
-        )
+        if self.fm.logging:
+            # Come nei log testuali originali, la durata dell'upload e' troncata al secondo
+            self.fm.log_event(my_logger.UPLOAD, self.env.now, self.id, f.get_id(), sf.get_id(),
+                              duration=int(upload_time))
 
     def p2p_upload(self, f, upload_time, upload_rate):
         """
-        La funzione simula l'upload del file "f", di durata "upload_time" e rate "upload_rate"
+        La funzione avvia l'upload del file "f" verso un peer, di durata "upload_time" e rate "upload_rate"
         :param f: file da mandare in upload
         :param upload_time: durata del trasferimento dati
         :param upload_rate: velocita' di trasferimento dei dati
         """
-        self.fm.log(
-            'Device %d starts uploading file "%d" to a peer, at %d: upload will lasts for %.2f' %
-            (self.id, f.get_id(), int(self.env.now), int(upload_time))
-        )
-        # Il contatore deve essere veritiero anche nel caso in cui la simulazione si interrompa
-        for t in range(upload_time):
-            yield self.env.timeout(1)
-            self.p2p_contribution += upload_rate
-
-    '''
-    def triggered_downloads(self, residual_time):
-        """
-        La funzione permette di scaricare in real-time i file caricati/modificati da altri dispositivi sulla cartella
-        condivisa
-        """
-        while self.env.now < self.end_session and self.triggerable:
-            # Attendo notifica da parte del server
-            yield self.trigger_lock.get(1)
-            if self.env.now < self.end_session and self.triggerable:
-                # Scarico il nuovo file, in parallelo agli upload
-                f = self.triggered_list.pop()
-                dr = new_download_rate(f)
-                dt = new_download_time(f.get_size(), dr)
-                if self.env.now + dt <= self.end_session:
-                    yield self.env.process(self.download(f, dt, dr))
+        if self.fm.logging:
+            self.fm.log_event(my_logger.P2P_UPLOAD, self.env.now, self.id, f.get_id(), duration=upload_time)
+        # Un solo evento per l'intero trasferimento: il contributo parziale e' calcolato da "p2p_contribution"
+        upload = (self.env.now, upload_rate, upload_time, self.cloud_env.next_timer())
+        self.p2p_uploads.append(upload)
+        self.cloud_env.start_timer(upload_time, self.p2p_upload_end, upload)
+
+    def p2p_upload_end(self, upload):
+        """
+        La funzione conclude un upload verso un peer
+        """
+        self.p2p_uploads.remove(upload)
+        self.p2p_uploaded += upload[1] * upload[2]
+
+    def next_live_download(self):
+        """
+        La funzione (un processo per sessione) scarica al volo i file caricati su Cloud da altri dispositivi, nell'ordine
+        in cui vengono notificati. Il processo termina al logout
+        """
+        while self.triggerable:
+            if len(self.triggered_list) == 0:
+                # Attendo notifica da parte del server
+                self.live_state = LIVE_IDLE
+                return
+            f = self.triggered_list.popleft()
+            # Il file potrebbe essere gia' stato scaricato
+            if f in self.missing_files:
+                self.live_file = f
+                self.live_rate = new_download_rate(f)
+                self.live_time = new_download_time(f.get_size(), self.live_rate)
+                self.stats.download_start(self, f)
+                if self.env.now + self.live_time <= self.end_session:
+                    # Ho tempo sufficiente per completare il download
+                    self.live_wait(LIVE_DOWNLOAD, self.live_time)
                 else:
-                    self.stats.download_start(self, f)
-                    yield self.env.timeout(int(self.end_session - self.env.now))
-                    self.stats.download_end(self, f, dr)
-                    self.fm.log('Device %s fails to download file "%d" on the fly at %d' % (self.id, f.get_id(),
-                                                                                            int(self.env.now)))
-    '''
+                    # Non riesco a scaricare il file per intero
+                    self.live_wait(LIVE_DOWNLOAD_FAILED, int(self.end_session - self.env.now))
+                return
+        self.live_state = None
+
+    def live_wait(self, state, delay):
+        """
+        Il processo dei download al volo resta nello stato "state" per "delay" secondi, poi prosegue con "live_step"
+        """
+        self.live_state = state
+        self.live_wake_at = self.env.now + delay
+        self.live_timer = self.cloud_env.next_timer()
+        self.cloud_env.start_timer(delay, self.live_step)
+
+    def live_step(self):
+        """
+        Allo scadere del timer, il processo dei download al volo conclude l'attivita' corrente e passa al file successivo
+        """
+        if self.live_state == LIVE_DOWNLOAD:
+            self.download_done(self.live_file, self.live_time, self.live_rate)
+        elif self.live_state == LIVE_DOWNLOAD_FAILED:
+            self.stats.download_end(self, self.live_file, self.live_rate)
+            if self.fm.logging:
+                self.fm.log_event(my_logger.LIVE_DOWNLOAD_FAILED, self.env.now, self.id, self.live_file.get_id())
+        self.live_file = None
+        self.next_live_download()
 
     def trigger_download(self, f):
         """
         La funzione permette di far scaricare al volo il file "f" al dispositivo, appena caricato su Cloud da altri
         """
-        # Il singolo device puo' scaricare un solo file per volta dal server -> Risorsa condivisa
-        yield self.trigger_lock.get(1)
-        # Tento di scaricare il file dal server
-        # Nota: in realta', qui potrei essere al di fuori della sessione, o in una nuova. Occorre tenerne conto,
-        # verificando che il dispositivo sia "triggerable" e che il file non sia stato gia' scaricato
-        if self.triggerable and (f in self.missing_files):
-            dr = new_download_rate(f)
-            dt = new_download_time(f.get_size(), dr)
-            if self.env.now + dt <= self.end_session:
-                # Ho tempo sufficiente per completare il download
-                yield self.env.process(self.download(f, dt, dr))
-            else:
-                # Non riesco a scaricare il file per intero
-                self.stats.download_start(self, f)
-                yield self.env.timeout(int(self.end_session - self.env.now))
-                self.stats.download_end(self, f, dr)
-                self.fm.log('Device %s fails to download file "%d" on the fly at %d' % (self.id, f.get_id(),
-                                                                                        int(self.env.now)))
-        # Rilascio la risorsa
-        yield self.trigger_lock.put(1)
+        self.triggered_list.append(f)
+        self.wake_live_worker()
+
+    def wake_live_worker(self):
+        """
+        La funzione risveglia il processo dei download al volo, se in attesa di notifiche
+        """
+        if self.live_state == LIVE_IDLE:
+            self.live_wait(LIVE_WAKING, 0)
 
     def new_file_to_download(self, f):
         """
@@ -475,25 +690,42 @@ class Device(object):
         da parte del Cloud Server
         """
         self.missing_files.add(f)
+        if self.cloud_env.peer_index is not None:
+            self.cloud_env.peer_index.discard(self, f)
+
+    def update_peer_index(self, f):
+        """
+        La funzione segnala all'indice dei peers che il dispositivo dispone ora del file "f"
+        """
+        if self.cloud_env.peer_index is not None:
+            self.cloud_env.peer_index.add(self, f)
 
     def session_start(self, session_duration):
         """
         La funzione esegue routine in fase di login del dispositivo
         """
-        self.fm.log('Device %s logged in at %s, on shared folder "%d"' % (self.id, int(self.env.now),
-                                                                          self.current_sf.get_id()))
+        if self.fm.logging:
+            self.fm.log_event(my_logger.LOGIN, self.env.now, self.id, folder=self.current_sf.get_id())
         self.end_session = int(self.env.now) + session_duration
         self.logged_in = True
+        if self.triggered_list is None:
+            self.missed_uploads = set([])
+            self.triggered_list = deque()
+            self.p2p_uploads = []
+            self.p2p_downloads = []
+        if self.cloud_env.peer_index is not None:
+            self.cloud_env.peer_index.login(self)
         self.stats.login(self)
 
     def session_end(self):
         """
         La funzinoe esegue routine in fase di logout del dispositivo
         """
-        # Triggered download non scaricati
+        # Triggered download non scaricati: risveglio il processo dei download al volo, che termina
         self.triggerable = False
         self.triggered_list.clear()
-        if self.trigger_lock.level > 0:
-            self.trigger_lock.get(self.trigger_lock.level)
+        self.wake_live_worker()
         self.logged_in = False
+        if self.cloud_env.peer_index is not None:
+            self.cloud_env.peer_index.logout(self)
         self.stats.logout(self)
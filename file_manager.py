@@ -1,4 +1,16 @@
+import hashlib
+import json
+import os
 import random
+import numpy
+import my_logger
+
+
+# Catalogo di testo dei file (dimensione in bytes, throughput) e formato della relativa cache binaria
+CATALOG_FILE = 'throughput.txt'
+CATALOG_TYPE = [('size', numpy.float64), ('throughput', numpy.float64)]
+# Versione del formato della cache: se cambia, le cache esistenti vengono ricompilate
+CATALOG_VERSION = 2
 
 
 def prepare_input(line):
@@ -11,23 +23,92 @@ def prepare_input(line):
     return file_size, throughput
 
 
-def get_files():
+def catalog_paths(src):
+    """
+    Ritorna i percorsi della cache binaria del catalogo "src" e dei relativi metadati
+    """
+    base = os.path.splitext(src)[0]
+    return base + '.catalog.npy', base + '.catalog.json'
+
+
+def file_hash(src):
+    """
+    Ritorna l'hash SHA-1 del contenuto del file "src"
+    """
+    with open(src, 'rb') as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+
+def compile_catalog(src=CATALOG_FILE):
     """
-    La funzione legge il file "throughput.txt" e crea un elenco di file: il loro ordine viene alterato casualmente
+    La funzione converte il catalogo di testo "src" in un vettore NumPy colonnare (dimensione in bytes, throughput),
+    salvato in formato .npy accanto al file di testo insieme ai metadati (mtime, dimensione e hash) del sorgente.
+    Le righe non valide (dimensione negativa o throughput non positivo) vengono scartate: darebbero tempi di
+    trasferimento negativi
     """
-    # Input da file
-    with open('throughput.txt', 'r') as fp:
+    cache, meta = catalog_paths(src)
+    with open(src, 'r') as fp:
         lines = fp.readlines()
-    splitted_lines = map(lambda x: prepare_input(x), lines[1:])
-    random.shuffle(splitted_lines)
-    # Creo la lista di file da memorizzare nel FileManager
-    res = []
-    next_id = 0
-    while len(splitted_lines) > 0:
-        file_size, throughput = splitted_lines.pop()
-        res.append(CloudFile(next_id, file_size, throughput))
-        next_id += 1
-    return res
+    catalog = numpy.empty(len(lines) - 1, dtype=CATALOG_TYPE)
+    for i, line in enumerate(lines[1:]):
+        catalog[i] = prepare_input(line)
+    catalog = catalog[(catalog['size'] >= 0) & (catalog['throughput'] > 0)]
+    # Scrittura atomica: altri processi potrebbero leggere la cache nello stesso momento
+    tmp = '%s.%d.tmp' % (cache, os.getpid())
+    with open(tmp, 'wb') as fp:
+        numpy.save(fp, catalog)
+    os.rename(tmp, cache)
+    write_catalog_meta(src)
+
+
+def write_catalog_meta(src):
+    """
+    Salva i metadati del catalogo di testo "src", usati per invalidarne la cache binaria
+    """
+    stat = os.stat(src)
+    _, meta = catalog_paths(src)
+    tmp = '%s.%d.tmp' % (meta, os.getpid())
+    with open(tmp, 'w') as fp:
+        json.dump({'version': CATALOG_VERSION, 'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': file_hash(src)},
+                  fp)
+    os.rename(tmp, meta)
+
+
+def load_catalog(src=CATALOG_FILE):
+    """
+    La funzione ritorna il catalogo dei file, mappato in memoria dalla cache binaria: la cache viene ricompilata se
+    assente, se e' stata creata da una versione diversa del formato, o se il file di testo e' cambiato. Per verificarlo
+    si confrontano prima mtime e dimensione del file con quelli salvati nei metadati; se differiscono, si confronta
+    l'hash sha1 del contenuto, e la cache viene ricompilata solo se anche questo e' diverso
+    """
+    cache, meta = catalog_paths(src)
+    try:
+        with open(meta, 'r') as fp:
+            info = json.load(fp)
+    except (IOError, ValueError):
+        info = None
+    if info is None or info.get('version') != CATALOG_VERSION or not os.path.exists(cache):
+        compile_catalog(src)
+    else:
+        stat = os.stat(src)
+        if (info['mtime'], info['size']) != (stat.st_mtime, stat.st_size):
+            if file_hash(src) == info['sha1']:
+                # Il contenuto non e' cambiato: aggiorno solo i metadati
+                write_catalog_meta(src)
+            else:
+                compile_catalog(src)
+    return numpy.load(cache, mmap_mode='r')
+
+
+def shuffled_order(n):
+    """
+    La funzione ritorna un ordine casuale degli indici del catalogo: l'i-esimo file caricato su Cloud e' quello di
+    indice order[i]
+    """
+    order = range(n)
+    random.shuffle(order)
+    order.reverse()
+    return order
 
 
 class CloudFile(object):
@@ -35,6 +116,8 @@ class CloudFile(object):
     La classe modellizza uno dei file che vengono scambiati sul cloud
     """
 
+    __slots__ = ('file_id', 'size', 'throughput')
+
     def __init__(self, fid, size, th):
         """
         file_id: numero intero
@@ -60,6 +143,8 @@ class SharedFile(CloudFile):
     La classe modellizza un file condiviso su Cloud tra piu' device
     """
 
+    __slots__ = ('sf', 'last_modified', 'last_device')
+
     @staticmethod
     def from_cloud(fc, sf, t, d):
         """
@@ -88,9 +173,21 @@ class SharedFile(CloudFile):
         # Ultimo device che l'ha caricato/modificato
         self.last_device = last_device
 
+    def key(self):
+        """
+        Ritorna la chiave del file logico (id della cartella condivisa, id del file), comune a tutte le sue versioni
+        """
+        return self.sf.get_id(), self.file_id
+
     def __eq__(self, other):
         return self.file_id == other.file_id and self.sf == other.sf
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key())
+
     def get_shared_folder(self):
         return self.sf
 
@@ -121,23 +218,62 @@ class FileManager(object):
         => L'id del file e' l'indice del file all'interno del vettore in cui sono memorizzati
         """
         self.next_id = 0
-        self.files = get_files()
+        # Catalogo dei file, mappato in memoria (condiviso tra processi) e letto in ordine casuale
+        catalog = load_catalog()
+        self.sizes = catalog['size']
+        self.throughputs = catalog['throughput']
+        self.order = shuffled_order(len(catalog))
+        # File caricati su Cloud finora, per id
+        self.files = []
+        self.set_logger(logger)
+        # Numero di eventi scritti dal logger, per tipo di evento
+        self.event_counts = {}
+
+    def __getstate__(self):
+        # Il catalogo mappato in memoria viene riaperto al restore, il logger viene fornito da CloudEnvironment.load
+        state = self.__dict__.copy()
+        del state['sizes'], state['throughputs'], state['logger']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        catalog = load_catalog()
+        self.sizes = catalog['size']
+        self.throughputs = catalog['throughput']
+        self.logger = None
+
+    def set_logger(self, logger):
         self.logger = logger
+        # Se falso, i dispositivi non generano eventi di log
+        self.logging = logger.enabled
+        # Livello minimo degli eventi scritti dal logger
+        self.log_level = logger.level if logger.enabled else my_logger.OFF
 
     def get_files_list(self):
-        return self.files
+        """
+        Ritorna l'elenco completo dei file del catalogo
+        """
+        return [self.cloud_file(fid) for fid in range(len(self.order))]
+
+    def cloud_file(self, fid):
+        """
+        Crea il CloudFile di id "fid", leggendone i dati dal catalogo
+        """
+        i = self.order[fid]
+        return CloudFile(fid, self.sizes[i], self.throughputs[i])
 
     def new_file(self):
-        f = self.files[self.next_id]
+        f = self.cloud_file(self.next_id)
+        self.files.append(f)
         self.next_id += 1
         return f
 
     def update_file(self):
-        f = random.choice(self.files[0:self.next_id])
+        f = random.choice(self.files)
         return f
 
     def new_upload(self):
-        p = round(self.next_id / len(self.files), 2)
+        p = round(self.next_id / len(self.order), 2)
         p2 = random.random()
         if p2 < p:
             # Update di file esistente
@@ -146,8 +282,34 @@ class FileManager(object):
             # Upload di un nuovo file nel Cloud
             return self.new_file()
 
-    def log(self, msg):
-        self.logger.log(msg)
+    def log_event(self, kind, time, device, file=-1, folder=-1, peer=-1, size=0.0, duration=0.0):
+        """
+        Registra un evento di simulazione (vedi my_logger.EVENTS): i chiamanti verificano prima "self.logging". Gli
+        eventi di livello inferiore a quello del logger non vengono scritti, ne' conteggiati
+        """
+        if my_logger.EVENTS[kind][0] < self.log_level:
+            return
+        self.event_counts[kind] = self.event_counts.get(kind, 0) + 1
+        self.logger.event(kind, time, device, file, folder, peer, size, duration)
+
+    def log_counts(self):
+        """
+        Ritorna l'elenco di coppie (messaggio, numero di occorrenze) scritte finora dal logger, in ordine decrescente
+        """
+        counts = [(my_logger.EVENTS[k][1], n) for k, n in self.event_counts.iteritems()]
+        counts.sort(key=lambda x: x[1], reverse=True)
+        return counts
+
+    def print_log_counts(self, top=10):
+        """
+        Stampa a schermo i "top" messaggi di log piu' frequenti
+        """
+        counts = self.log_counts()
+        total = sum([n for _, n in counts])
+        print('### LOG MESSAGES ###')
+        print('Total number of log messages: %d' % total)
+        for template, n in counts[:top]:
+            print('%d (%.2f%%): %s' % (n, 100.0 * n / total, template))
 
 
 if __name__ == '__main__':
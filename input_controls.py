@@ -1,4 +1,4 @@
-from timed_structures import TimedArray
+from timed_structures import TimedArray, CompactTimedArray
 import types
 
 
@@ -80,7 +80,7 @@ def check_timed_array(value, name):
     """
     La funzione verifica che "value" sia un'istanza della classe "TimedArray"
     """
-    if not isinstance(value, TimedArray):
+    if not isinstance(value, (TimedArray, CompactTimedArray)):
         raise TypeError('the parameter "%s" is invalid: it must be a timed array' % name)
 
 
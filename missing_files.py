@@ -0,0 +1,77 @@
+from collections import OrderedDict
+
+
+class MissingFiles(object):
+    """
+    Elenco dei file che un dispositivo deve scaricare, suddiviso per cartella condivisa: per ogni cartella, i file sono
+    mantenuti in ordine di notifica, e l'ultimo notificato e' il prossimo da scaricare
+    """
+
+    __slots__ = ('_folders', '_size')
+
+    def __init__(self):
+        # Cartella condivisa -> OrderedDict {file: versione da scaricare}
+        self._folders = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, f):
+        files = self._folders.get(f.get_shared_folder())
+        return files is not None and f in files
+
+    def __iter__(self):
+        for files in self._folders.itervalues():
+            for f in files.itervalues():
+                yield f
+
+    def add(self, f):
+        """
+        Aggiunge il file "f" all'elenco (se gia' presente, ne aggiorna la versione e lo rende l'ultimo notificato)
+        """
+        sf = f.get_shared_folder()
+        files = self._folders.get(sf)
+        if files is None:
+            files = self._folders[sf] = OrderedDict()
+        if f in files:
+            # Nuova versione di un file gia' in elenco: diventa l'ultima notificata
+            del files[f]
+        else:
+            self._size += 1
+        files[f] = f
+
+    def remove(self, f):
+        """
+        Rimuove il file "f" dall'elenco, se la versione da scaricare non e' piu' recente di "f" (una nuova versione
+        notificata durante il download di "f" resta da scaricare): se il file non e' presente, lancia KeyError
+        Ritorna True se il file e' stato rimosso
+        """
+        files = self._folders[f.get_shared_folder()]
+        stored = files[f]
+        if stored is not f and stored.get_last_modified() > f.get_last_modified():
+            return False
+        del files[f]
+        self._size -= 1
+        return True
+
+    def discard(self, f):
+        """
+        Rimuove il file "f" dall'elenco, se presente
+        """
+        if f in self:
+            self.remove(f)
+
+    def count(self, sf):
+        """
+        Ritorna il numero di file da scaricare dalla cartella condivisa "sf"
+        """
+        files = self._folders.get(sf)
+        return 0 if files is None else len(files)
+
+    def last(self, sf):
+        """
+        Ritorna il prossimo file da scaricare dalla cartella condivisa "sf" (l'ultimo notificato), senza rimuoverlo
+        """
+        files = self._folders[sf]
+        return files[next(reversed(files))]
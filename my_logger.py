@@ -1,13 +1,198 @@
+import Queue
+import atexit
+import struct
+import sys
+import threading
+
+
+# Livelli di log: gli eventi con livello inferiore a quello del logger vengono scartati (da FileManager.log_event)
+DEBUG = 10
+INFO = 20
+OFF = 100
+
+# Tipi di evento generati dai dispositivi
+LOGIN = 1
+LOGOUT = 2
+NO_DOWNLOADS = 3
+DOWNLOADS_DONE = 4
+DOWNLOAD = 5
+DOWNLOAD_ON_FLY = 6
+DOWNLOAD_FAILED = 7
+LIVE_DOWNLOAD_FAILED = 8
+P2P_DOWNLOAD = 9
+P2P_PARTIAL_DOWNLOAD = 10
+P2P_UPLOAD = 11
+INTER_UPLOAD = 12
+NO_UPLOAD_TIME = 13
+UPLOAD = 14
+UPLOAD_FAILED = 15
+
+# Tipo di evento -> (livello, messaggio testuale)
+EVENTS = {
+    LOGIN: (INFO, 'Device %(device)d logged in at %(time)d, on shared folder "%(folder)d"'),
+    LOGOUT: (INFO, 'Device %(device)d logs out at %(time)d: session lasts for %(duration)d'),
+    NO_DOWNLOADS: (DEBUG, 'Device %(device)d has no file to download from the server'),
+    DOWNLOADS_DONE: (DEBUG, 'Device %(device)d finishes its downloads at %(time)d'),
+    DOWNLOAD: (INFO, 'Device %(device)d downloads file "%(file)d" from the server at %(time)d: download lasts for '
+                     '%(duration).2f'),
+    DOWNLOAD_ON_FLY: (INFO, 'Device %(device)d downloads on fly file "%(file)d" from the server at %(time)d: download '
+                            'lasts for %(duration).2f'),
+    DOWNLOAD_FAILED: (INFO, 'Device %(device)d fails to download on fly file "%(file)d" at %(time)d'),
+    LIVE_DOWNLOAD_FAILED: (INFO, 'Device %(device)d fails to download file "%(file)d" on the fly at %(time)d'),
+    P2P_DOWNLOAD: (INFO, 'Device %(device)d downloads the entire file "%(file)d" (size: %(size).2f bits) from the peer '
+                         '"%(peer)d" at %(time)d: download lasts for %(duration).2f'),
+    P2P_PARTIAL_DOWNLOAD: (INFO, 'Device %(device)d downloads a portion of file "%(file)d" (size: %(size).2f bits) '
+                                 'from the peer "%(peer)d" at %(time)d: download lasts for %(duration).2f'),
+    P2P_UPLOAD: (DEBUG, 'Device %(device)d starts uploading file "%(file)d" to a peer, at %(time)d: upload will lasts '
+                        'for %(duration).2f'),
+    INTER_UPLOAD: (DEBUG, 'Device %(device)d starts waiting an inter-upload time of %(duration)d at %(time)d'),
+    NO_UPLOAD_TIME: (DEBUG, 'Device %(device)d has no time to upload file (inter-upload time) at %(time)d'),
+    UPLOAD: (INFO, 'Device %(device)d uploads file "%(file)d" in shared folder "%(folder)d", at %(time)d: upload lasts '
+                   'for %(duration).2f'),
+    UPLOAD_FAILED: (INFO, 'Device %(device)d fails to upload file "%(file)d" at %(time)d'),
+}
+
+# Campi di un evento, nell'ordine in cui vengono memorizzati
+FIELDS = ('kind', 'time', 'device', 'file', 'folder', 'peer', 'size', 'duration')
+# Formato binario di un evento: tipo, tempo, device, file, cartella, peer, dimensione, durata
+RECORD = struct.Struct('<Bdiiiidd')
+
+
+def format_event(record):
+    """
+    Ritorna il messaggio testuale di un evento, passato come tupla nell'ordine di FIELDS
+    """
+    return EVENTS[record[0]][1] % dict(zip(FIELDS, record))
+
+
 class Logger(object):
     """
     La classe modellizza un logger, per generare un file di testo di output
     """
 
-    def __init__(self, fp):
+    def __init__(self, fp, level=DEBUG):
         self.fp = open(fp, 'w')
+        self.level = level
+        # Se falso, i dispositivi non generano eventi di log
+        self.enabled = level < OFF
 
     def log(self, msg):
         self.fp.write(msg + '\n')
 
+    def event(self, kind, time, device, file=-1, folder=-1, peer=-1, size=0.0, duration=0.0):
+        """
+        Scrive il messaggio testuale di un evento (il filtro per livello e' in FileManager.log_event)
+        """
+        self.log(format_event((kind, time, device, file, folder, peer, size, duration)))
+
+    def close(self):
+        self.fp.close()
+
+
+class NullLogger(object):
+    """
+    Logger che scarta tutti i messaggi (ad esempio, per le repliche eseguite in parallelo)
+    """
+
+    enabled = False
+
+    def log(self, msg):
+        pass
+
+    def event(self, kind, time, device, file=-1, folder=-1, peer=-1, size=0.0, duration=0.0):
+        pass
+
     def close(self):
-        self.fp.close()
\ No newline at end of file
+        pass
+
+
+class BinaryLogger(object):
+    """
+    Logger che memorizza gli eventi come record binari a lunghezza fissa (RECORD): i record vengono accumulati in un
+    buffer e scritti su file da un thread dedicato. Il file si converte in testo con to_text(). Il logger viene chiuso
+    (scrivendo i record ancora in buffer) anche all'uscita del programma, se non e' stato chiuso prima
+    """
+
+    def __init__(self, fp, level=DEBUG, buffer_records=8192):
+        """
+        :param fp: percorso del file di output
+        :param level: livello minimo degli eventi da registrare (OFF = nessun evento)
+        :param buffer_records: numero di record accumulati prima di passarli al thread di scrittura
+        """
+        self.fp = open(fp, 'wb')
+        self.level = level
+        self.enabled = level < OFF
+        self.buffer_records = buffer_records
+        self._buffer = []
+        self._queue = Queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop)
+        self._writer.daemon = True
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _write_loop(self):
+        """
+        Thread di scrittura: scrive i blocchi di record ricevuti, fino al blocco vuoto di terminazione
+        """
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            self.fp.write(chunk)
+
+    def log(self, msg):
+        """
+        I messaggi liberi non hanno un formato binario: vengono scartati
+        """
+        pass
+
+    def event(self, kind, time, device, file=-1, folder=-1, peer=-1, size=0.0, duration=0.0):
+        """
+        Accoda il record di un evento (il filtro per livello e' in FileManager.log_event)
+        """
+        self._buffer.append(RECORD.pack(kind, time, device, file, folder, peer, size, duration))
+        if len(self._buffer) >= self.buffer_records:
+            self.flush()
+
+    def flush(self):
+        """
+        Passa i record accumulati al thread di scrittura
+        """
+        if len(self._buffer) > 0:
+            self._queue.put(''.join(self._buffer))
+            self._buffer = []
+
+    def close(self):
+        if self.fp.closed:
+            return
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        self.fp.close()
+
+
+def read_events(fp, chunk_records=8192):
+    """
+    Legge un file generato da BinaryLogger, ritornando un evento per volta come tupla nell'ordine di FIELDS
+    """
+    with open(fp, 'rb') as f:
+        while True:
+            chunk = f.read(RECORD.size * chunk_records)
+            if not chunk:
+                break
+            for i in range(0, len(chunk) - len(chunk) % RECORD.size, RECORD.size):
+                yield RECORD.unpack_from(chunk, i)
+
+
+def to_text(src, dst):
+    """
+    Converte il file binario "src" (BinaryLogger) nel file di testo "dst"
+    """
+    with open(dst, 'w') as out:
+        for record in read_events(src):
+            out.write(format_event(record) + '\n')
+
+
+if __name__ == '__main__':
+    # Conversione da riga di comando: python my_logger.py log.bin log.txt
+    to_text(sys.argv[1], sys.argv[2])
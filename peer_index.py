@@ -0,0 +1,64 @@
+class PeerIndex(object):
+    """
+    La classe tiene traccia, per ogni file condiviso, dei dispositivi attualmente online che ne dispongono della
+    versione aggiornata: serve per trovare i peers di un download P2P senza scorrere l'intera rete
+    """
+
+    def __init__(self):
+        # File -> {id del device: device} dei dispositivi online che possiedono il file
+        self.holders = {}
+        # Id del device -> insieme dei file per cui e' registrato nell'indice
+        self.holdings = {}
+
+    def add(self, d, f):
+        """
+        Registra il device "d" (online) tra i possessori del file "f"
+        """
+        if not d.is_on():
+            return
+        holders = self.holders.get(f)
+        if holders is None:
+            holders = self.holders[f] = {}
+        holders[d.id] = d
+        self.holdings.setdefault(d.id, set()).add(f)
+
+    def discard(self, d, f):
+        """
+        Rimuove il device "d" dai possessori del file "f", se presente
+        """
+        holdings = self.holdings.get(d.id)
+        if holdings is None or f not in holdings:
+            return
+        holdings.remove(f)
+        holders = self.holders[f]
+        del holders[d.id]
+        if len(holders) == 0:
+            del self.holders[f]
+
+    def login(self, d):
+        """
+        Il device "d" effettua il login: lo registro per i file aggiornati delle sue cartelle condivise
+        """
+        for sf in d.my_shared_folders:
+            for f in sf.files.itervalues():
+                if d.has_file(f):
+                    self.add(d, f)
+
+    def logout(self, d):
+        """
+        Il device "d" effettua il logout: non puo' piu' fare da peer
+        """
+        for f in self.holdings.pop(d.id, ()):
+            holders = self.holders[f]
+            del holders[d.id]
+            if len(holders) == 0:
+                del self.holders[f]
+
+    def look_for(self, f):
+        """
+        Ritorna l'elenco (ordinato per id) dei dispositivi online che dispongono del file "f"
+        """
+        holders = self.holders.get(f)
+        if holders is None:
+            return []
+        return [holders[i] for i in sorted(holders)]
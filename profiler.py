@@ -0,0 +1,156 @@
+import time
+import device
+
+
+# Metodi di StatsManager cronometrati dal profiler
+STATS_HOOKS = [
+    'login', 'logout', 'download_start', 'download_end', 'download_successful', 'p2p_download_start',
+    'p2p_download_end', 'upload_start', 'upload_end', 'upload_successful',
+]
+
+# Tipo di evento, a seconda dello stato in cui il dispositivo attende il timer
+STEP_KINDS = {
+    device.OFFLINE: 'session timeout',
+    device.P2P_DOWNLOAD: 'p2p transfer timeout',
+    device.DOWNLOAD: 'download timeout',
+    device.DOWNLOAD_FAILED: 'download timeout',
+    device.INTER_UPLOAD: 'inter-upload timeout',
+    device.NO_UPLOAD_TIME: 'inter-upload timeout',
+    device.UPLOAD: 'upload timeout',
+    device.UPLOAD_FAILED: 'upload timeout',
+}
+LIVE_KINDS = {
+    device.LIVE_WAKING: 'trigger wake-up',
+    device.LIVE_DOWNLOAD: 'live download timeout',
+    device.LIVE_DOWNLOAD_FAILED: 'live download timeout',
+}
+CALLBACK_KINDS = {
+    'p2p_upload_end': 'p2p_upload end',
+    'p2p_download_end': 'p2p_download end',
+}
+
+
+def event_kind(callback):
+    """
+    Ritorna il tipo di evento di un timer, a partire dalla funzione che verra' chiamata alla sua scadenza
+    """
+    name = callback.__name__
+    if name == 'step':
+        return STEP_KINDS[callback.__self__.state]
+    if name == 'live_step':
+        return LIVE_KINDS[callback.__self__.live_state]
+    return CALLBACK_KINDS.get(name, name)
+
+
+class Profiler(object):
+    """
+    Strumentazione opzionale della simulazione: conta gli eventi processati per tipo, ne misura il tempo di
+    elaborazione, cronometra i metodi di StatsManager, la ricerca dei peers, la ripartizione dei download P2P e il
+    logging, e campiona la dimensione della coda degli eventi di simpy. I metodi vengono sostituiti solo sulle istanze
+    di una CloudEnvironment creata con "profiler": senza profiler la simulazione non ha alcun costo aggiuntivo
+    """
+
+    def __init__(self, sample_interval=3600):
+        """
+        :param sample_interval: intervallo (s di simulazione) tra due campioni della dimensione della coda degli eventi
+        """
+        self.sample_interval = sample_interval
+        # Tipo di evento -> [numero di eventi, tempo di elaborazione (s)]
+        self.events = {}
+        # Funzione cronometrata -> [numero di chiamate, tempo (s)]
+        self.calls = {}
+        # Campioni (istante, eventi in coda)
+        self.heap_sizes = []
+        self.n_events = 0
+        self.wall_time = 0.0
+        self.sim_time = 0.0
+
+    def attach(self, cloud_env):
+        """
+        Installa la strumentazione su "cloud_env": va chiamata prima di generare la rete, per classificare anche i
+        timer iniziali dei dispositivi (vedi CloudEnvironment)
+        """
+        start_timer = cloud_env.start_timer
+
+        def profiled_start_timer(delay, callback, *args):
+            return start_timer(delay, self.timed_event(event_kind(callback), callback), *args)
+
+        cloud_env.start_timer = profiled_start_timer
+        cloud_env.look_for_peers = self.timed('look_for_peers', cloud_env.look_for_peers)
+        cloud_env.p2p_policy = self.timed('p2p_policy', cloud_env.p2p_policy)
+        cloud_env.file_manager.log_event = self.timed('log_event', cloud_env.file_manager.log_event)
+        for name in STATS_HOOKS:
+            setattr(cloud_env.stats, name, self.timed('StatsManager.' + name, getattr(cloud_env.stats, name)))
+
+    def timed(self, name, function):
+        """
+        Ritorna la funzione "function", cronometrata sotto il nome "name"
+        """
+        stats = self.calls.setdefault(name, [0, 0.0])
+
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats[0] += 1
+                stats[1] += time.time() - start
+        return wrapper
+
+    def timed_event(self, kind, callback):
+        """
+        Ritorna la funzione "callback" di un timer, conteggiata e cronometrata come evento di tipo "kind"
+        """
+        stats = self.events.setdefault(kind, [0, 0.0])
+
+        def wrapper(*args):
+            start = time.time()
+            try:
+                return callback(*args)
+            finally:
+                stats[0] += 1
+                stats[1] += time.time() - start
+        return wrapper
+
+    def run(self, env, until):
+        """
+        Esegue la simulazione "env" fino all'istante "until" (come env.run), evento per evento
+        """
+        start = time.time()
+        start_now = env.now
+        next_sample = env.now
+        n = 0
+        while env.peek() < until:
+            if env.now >= next_sample:
+                # simpy non espone la dimensione della coda degli eventi
+                self.heap_sizes.append((env.now, len(env._queue)))
+                next_sample = env.now + self.sample_interval
+            env.step()
+            n += 1
+        # Nessun altro evento prima di "until": porto l'orologio della simulazione all'istante finale
+        if env.now < until:
+            env.run(until=until)
+        self.n_events += n
+        self.wall_time += time.time() - start
+        self.sim_time += until - start_now
+
+    def report(self):
+        """
+        Stampa a schermo le statistiche raccolte
+        """
+        print('### PROFILER ###')
+        print('Processed events: %d in %.2f s (%.0f events/s)' % (
+            self.n_events, self.wall_time, self.n_events / self.wall_time if self.wall_time > 0 else 0))
+        print('Simulated seconds per wall-clock second: %.0f' % (
+            self.sim_time / self.wall_time if self.wall_time > 0 else 0))
+        if len(self.heap_sizes) > 0:
+            sizes = [size for _, size in self.heap_sizes]
+            print('Events in queue: min %d, mean %.0f, max %d (%d samples)' % (
+                min(sizes), float(sum(sizes)) / len(sizes), max(sizes), len(sizes)))
+        print('Events by kind (time includes the nested calls below):')
+        for kind, (n, t) in sorted(self.events.iteritems(), key=lambda x: x[1][1], reverse=True):
+            print('  %s: %d events, %.3f s (%.1f us/event)' % (kind, n, t, t / n * 1e6 if n > 0 else 0))
+        print('Timed calls:')
+        for name, (n, t) in sorted(self.calls.iteritems(), key=lambda x: x[1][1], reverse=True):
+            if n > 0:
+                print('  %s: %d calls, %.3f s (%.1f us/call)' % (name, n, t, t / n * 1e6))
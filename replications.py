@@ -0,0 +1,195 @@
+import Queue
+import math
+import multiprocessing
+import random
+import traceback
+import numpy
+from scipy import stats as st
+import cloud_env
+import my_logger
+import samplers
+import steady_state
+
+
+# Metriche di StatsManager.summary() riportate al termine delle repliche
+METRICS = [
+    ('mean_in_traffic', 'Average server incoming traffic', 'b/s'),
+    ('mean_out_traffic', 'Average server outgoing traffic', 'b/s'),
+    ('p2p_share', 'P2P share of the downloaded traffic', ''),
+    ('mean_download_time', 'Average download duration', 's'),
+    ('mean_upload_time', 'Average upload duration', 's'),
+    ('mean_downloading_time', 'Average time spent by a device downloading data', 's'),
+    ('mean_uploading_time', 'Average time spent by a device uploading data', 's'),
+]
+
+
+def new_config(n_devices, until, server=True, seed=0):
+    """
+    Ritorna la configurazione di una singola replica
+    """
+    return {'n_devices': n_devices, 'until': until, 'server': server, 'seed': seed}
+
+
+def run_replication(config):
+    """
+    Esegue una replica della simulazione e ne ritorna le metriche riassuntive (non l'intero ambiente, per limitare i
+    dati scambiati tra processi)
+    :param config: dizionario con chiavi "n_devices", "until", "server" e "seed" (opzionali: "dv_dg", "sf_dg", e
+        "precision" per concludere la replica appena le stime a regime raggiungono la precisione relativa indicata)
+    """
+    seed = config['seed']
+    random.seed(seed)
+    numpy.random.seed(seed)
+    samplers.reset()
+    env = cloud_env.CloudEnvironment(config['n_devices'], my_logger.NullLogger(), server=config['server'],
+                                     dv_dg=config.get('dv_dg', cloud_env.DV_DG),
+                                     sf_dg=config.get('sf_dg', cloud_env.SF_DG))
+    monitor = None
+    if config.get('precision') is not None:
+        monitor = steady_state.SteadyStateMonitor(config['precision'])
+    env.run(config['until'], report=False, monitor=monitor)
+    summary = env.stats.summary()
+    summary['seed'] = seed
+    return summary
+
+
+def run_replication_safe(config):
+    """
+    Come run_replication, ma ritorna la coppia (metriche, None), oppure (configurazione, traceback) se la replica
+    fallisce: i callback del pool non ricevono le eccezioni
+    """
+    try:
+        return run_replication(config), None
+    except Exception:
+        return config, traceback.format_exc()
+
+
+def run_replications(configs, processes=None):
+    """
+    Esegue in parallelo le repliche "configs", su un pool di "processes" processi (None = numero di core)
+    Ritorna le metriche delle repliche, ordinate per seed
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = list(pool.imap_unordered(run_replication, configs))
+    finally:
+        pool.close()
+        pool.join()
+    results.sort(key=lambda r: r['seed'])
+    return results
+
+
+def confidence_interval(values, confidence=0.95):
+    """
+    Ritorna la coppia (media, semi-ampiezza dell'intervallo di confidenza) dei valori "values", secondo la
+    distribuzione t di Student. I valori NaN vengono ignorati
+    """
+    values = [v for v in values if not math.isnan(v)]
+    n = len(values)
+    if n == 0:
+        return float('nan'), float('nan')
+    m = float(numpy.mean(values))
+    if n < 2:
+        return m, float('nan')
+    half_width = st.t.ppf((1 + confidence) / 2.0, n - 1) * numpy.std(values, ddof=1) / math.sqrt(n)
+    return m, float(half_width)
+
+
+def aggregate(results, confidence=0.95):
+    """
+    Ritorna, per ogni metrica, la coppia (media, semi-ampiezza dell'intervallo di confidenza) sulle repliche
+    """
+    res = {}
+    for metric, _, _ in METRICS:
+        res[metric] = confidence_interval([r[metric] for r in results], confidence)
+    return res
+
+
+def replicate(n_devices, until, n_runs, server=True, seed=0, processes=None, confidence=0.95):
+    """
+    Esegue "n_runs" repliche indipendenti (seed consecutivi a partire da "seed") e ne stampa le statistiche
+    """
+    configs = [new_config(n_devices, until, server, seed + i) for i in range(n_runs)]
+    results = run_replications(configs, processes)
+    aggregated = aggregate(results, confidence)
+    report(aggregated, len(results), confidence)
+    return aggregated
+
+
+def is_precise(results, targets, confidence=0.95):
+    """
+    Verifica che, per ogni metrica di "targets" (dizionario metrica -> semi-ampiezza massima dell'intervallo di
+    confidenza, relativa alla media), le repliche "results" abbiano raggiunto la precisione richiesta
+    """
+    for metric, target in targets.iteritems():
+        m, half_width = confidence_interval([r[metric] for r in results], confidence)
+        if steady_state.relative_precision(m, half_width) > target:
+            return False
+    return True
+
+
+def replicate_until(n_devices, until, targets, server=True, seed=0, processes=None, confidence=0.95, min_runs=4,
+                    max_runs=256):
+    """
+    Esegue repliche indipendenti (seed consecutivi a partire da "seed"), mantenendone in esecuzione una per processo,
+    finche' gli intervalli di confidenza delle metriche "targets" non raggiungono la precisione richiesta (vedi
+    is_precise) o finche' non sono state eseguite "max_runs" repliche. Le repliche ancora in corso vengono poi
+    interrotte. Il criterio viene valutato solo sui seed consecutivi gia' conclusi, per cui il numero di repliche
+    non dipende dall'ordine in cui terminano
+    Ritorna la coppia (metriche aggregate, metriche delle repliche usate), e ne stampa le statistiche
+    """
+    workers = processes if processes is not None else multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(workers)
+    completed = Queue.Queue()
+    done = {}
+    submitted = 0
+    n_runs = 0
+    try:
+        while True:
+            # Mantengo una replica in esecuzione per processo
+            while submitted < max_runs and submitted - len(done) < workers:
+                config = new_config(n_devices, until, server, seed + submitted)
+                pool.apply_async(run_replication_safe, (config,), callback=completed.put)
+                submitted += 1
+            result, error = completed.get()
+            if error is not None:
+                raise RuntimeError('replication with seed %d failed:\n%s' % (result['seed'], error))
+            done[result['seed']] = result
+            while seed + n_runs in done:
+                n_runs += 1
+            results = [done[seed + i] for i in range(n_runs)]
+            if n_runs >= min_runs and is_precise(results, targets, confidence):
+                break
+            if n_runs == max_runs:
+                print('Target precision not reached after %d replications' % max_runs)
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+    aggregated = aggregate(results, confidence)
+    report(aggregated, n_runs, confidence)
+    return aggregated, results
+
+
+def report(aggregated, n_runs, confidence=0.95):
+    """
+    Stampa a schermo le medie delle metriche con i relativi intervalli di confidenza
+    """
+    print('### REPLICATIONS STATS ###')
+    print('Number of replications: %d (confidence level: %d%%)' % (n_runs, round(confidence * 100)))
+    for metric, label, unit in METRICS:
+        m, half_width = aggregated[metric]
+        print('%s: %.2f +/- %.2f %s' % (label, m, half_width, unit))
+
+
+if __name__ == '__main__':
+    # Numero di dispositivi
+    NUM_DEV = 500
+    # Tempo di simulazione
+    SIM_TIME = 360000
+    # Numero di repliche
+    N_RUNS = 32
+
+    replicate(NUM_DEV, SIM_TIME, N_RUNS, server=True)
+    # In alternativa, il numero di repliche puo' essere deciso dalla precisione richiesta (semi-ampiezza relativa)
+    # replicate_until(NUM_DEV, SIM_TIME, {'mean_out_traffic': 0.05, 'mean_download_time': 0.05}, server=True)
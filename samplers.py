@@ -0,0 +1,96 @@
+import numpy
+
+
+# Numero di valori estratti ad ogni ricarica di un buffer (se non specificato per il singolo buffer)
+BLOCK_SIZE = 4096
+
+# Elenco dei buffer creati, per poterli svuotare tutti dopo un nuovo seed
+_pools = []
+
+
+class VariatePool(object):
+    """
+    Buffer di variabili aleatorie: i valori vengono estratti a blocchi, con una sola chiamata vettoriale a NumPy, e
+    restituiti uno per volta. A parita' di seed e di dimensione dei blocchi, la sequenza prodotta e' riproducibile
+    """
+
+    def __init__(self, draw, block_size=None):
+        """
+        :param draw: funzione draw(n), ritorna un vettore NumPy di n campioni
+        :param block_size: numero di campioni per blocco (None = BLOCK_SIZE)
+        """
+        self.draw = draw
+        self.block_size = block_size
+        # Valori ancora da consumare, in ordine inverso di estrazione
+        self._buffer = []
+        _pools.append(self)
+
+    def get(self):
+        """
+        Ritorna il prossimo valore del buffer, ricaricandolo se esaurito
+        """
+        try:
+            return self._buffer.pop()
+        except IndexError:
+            self.refill()
+            return self._buffer.pop()
+
+    def refill(self):
+        """
+        Estrae un nuovo blocco di valori
+        """
+        n = self.block_size if self.block_size is not None else BLOCK_SIZE
+        self._buffer = self.draw(n)[::-1].tolist()
+
+    def reset(self):
+        """
+        Scarta i valori gia' estratti
+        """
+        self._buffer = []
+
+
+def lognormal(mean, sigma, block_size=None):
+    """
+    Buffer di valori con distribuzione lognormale di parametri "mean" e "sigma"
+    """
+    return VariatePool(lambda n: numpy.random.lognormal(mean=mean, sigma=sigma, size=n), block_size)
+
+
+def uniform(block_size=None):
+    """
+    Buffer di valori con distribuzione uniforme in [0, 1)
+    """
+    return VariatePool(lambda n: numpy.random.random_sample(n), block_size)
+
+
+def set_block_size(block_size):
+    """
+    Modifica la dimensione di default dei blocchi
+    """
+    global BLOCK_SIZE
+    BLOCK_SIZE = int(block_size)
+
+
+def get_state():
+    """
+    Ritorna i valori non ancora consumati di tutti i buffer, per salvare lo stato della simulazione
+    """
+    return [list(pool._buffer) for pool in _pools]
+
+
+def set_state(state):
+    """
+    Ripristina i valori dei buffer salvati con get_state
+    """
+    if len(state) != len(_pools):
+        raise ValueError('%d buffers saved, %d buffers created' % (len(state), len(_pools)))
+    for pool, buffer in zip(_pools, state):
+        pool._buffer = list(buffer)
+
+
+def reset():
+    """
+    Svuota tutti i buffer: va chiamata dopo numpy.random.seed(), per riprodurre la stessa sequenza di valori
+    """
+    for pool in _pools:
+        pool.reset()
@@ -3,13 +3,24 @@ class SharedFolder(object):
     La classe modellizza una cartella di file condivisa tra diversi dispositivi su Cloud storage
     """
 
+    __slots__ = ('id', 'devices', 'files')
+
     def __init__(self, id_folder):
         # ID della cartella condivisa
         self.id = id_folder
         # Dispositivi che condividono la cartella
         self.devices = []
-        # Elenco aggiornato dei file nella cartella condivisa
-        self.files = set([])
+        # Versione corrente dei file nella cartella condivisa: chiave del file -> SharedFile
+        self.files = {}
+
+    def __getstate__(self):
+        # I dispositivi vengono salvati per id (evita catene di riferimenti troppo profonde): vedi CloudEnvironment.load
+        return {'id': self.id, 'devices': [d.id for d in self.devices], 'files': self.files}
+
+    def __setstate__(self, state):
+        self.id = state['id']
+        self.devices = state['devices']
+        self.files = state['files']
 
     # fancy printing as string
     def __str__(self):
@@ -18,28 +29,37 @@ class SharedFolder(object):
     def __eq__(self, other):
         return self.id == other.id
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.id)
+
     # add a device to the list of devices registering this shared folder
     def add_device(self, device):
         self.devices.append(device)
         # Notifico il device circa i file da scaricare, presenti nella cartella a cui si e' unito
-        for f in self.files:
+        for f in self.files.itervalues():
             device.new_file_to_download(f)
 
     def has_file(self, f):
         """
         Verifica che il file sia presente all'interno della cartella condivisa
         """
-        return f in self.files
+        return f.key() in self.files
 
     def upload_file(self, f, timestamp):
-        if self.has_file(f):
-            # Aggiorno il riferimento puntatore
-            if f.update(timestamp):
-                # Notifico gli altri client delle nuove modifiche al file
-                self.notify_devices(f)
-        else:
+        key = f.key()
+        current = self.files.get(key)
+        if current is None:
             # Aggiungo il file (nuovo)
-            self.files.add(f)
+            self.files[key] = f
+            self.notify_devices(f)
+        elif current.get_last_modified() < timestamp:
+            # La modifica e' piu' recente della versione corrente: "f" diventa la nuova versione del file
+            f.update(timestamp)
+            self.files[key] = f
+            # Notifico gli altri client delle nuove modifiche al file
             self.notify_devices(f)
 
     def notify_devices(self, f):
@@ -50,7 +70,7 @@ class SharedFolder(object):
             if d.id != f.get_last_device():
                 d.new_file_to_download(f)
                 if d.env.now < d.end_session and d.triggerable:
-                    # Scarico il nuovo file, in parallelo agli upload
+                    # Scarico il nuovo file, in parallelo agli upload (accodandolo al processo dedicato del device)
                     d.trigger_download(f)
 
     def get_id(self):
@@ -60,6 +80,6 @@ class SharedFolder(object):
         """
         Ritorna il time stamp di ultima modifica del file, contenuto all'interno di questa cartella condivisa
         """
-        for x in self.files:
-            if x == f:
-                return x.get_last_modified()
+        current = self.files.get(f.key())
+        if current is not None:
+            return current.get_last_modified()
@@ -0,0 +1,123 @@
+import math
+import numpy
+from scipy import stats as st
+import timed_structures as ts
+
+
+# Dimensione dei lotti su cui viene applicato MSER (MSER-5)
+MSER_BATCH = 5
+
+
+def mser(values, batch_size=MSER_BATCH):
+    """
+    Stima la durata del transitorio iniziale di una serie di osservazioni con il metodo MSER: le osservazioni vengono
+    mediate a lotti di "batch_size", e il punto di troncamento d (al piu' meta' dei lotti) e' quello che minimizza
+    l'errore standard della media dei lotti rimanenti, sum((y[d:] - media(y[d:])) ** 2) / (n - d) ** 2
+    Ritorna il numero di osservazioni da scartare
+    """
+    n = len(values) // batch_size
+    if n < 2:
+        return 0
+    y = numpy.asarray(values[:n * batch_size], dtype=numpy.float64).reshape(n, batch_size).mean(axis=1)
+    # Somme e somme dei quadrati di ogni coda y[d:], per tutti i d
+    tail_sum = numpy.cumsum(y[::-1])[::-1]
+    tail_sq = numpy.cumsum((y * y)[::-1])[::-1]
+    count = numpy.arange(n, 0, -1, dtype=numpy.float64)
+    mser_stat = (tail_sq - tail_sum * tail_sum / count) / (count * count)
+    return int(numpy.argmin(mser_stat[:n // 2 + 1])) * batch_size
+
+
+def batch_means(values, n_batches=20, confidence=0.95):
+    """
+    Ritorna la coppia (media, semi-ampiezza dell'intervallo di confidenza) di una serie stazionaria di osservazioni
+    correlate, con il metodo delle medie a lotti: le osservazioni piu' vecchie che non completano un lotto vengono
+    scartate
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    size = len(values) // n_batches
+    if size == 0:
+        return float(values.mean()) if len(values) > 0 else float('nan'), float('nan')
+    batches = values[len(values) - size * n_batches:].reshape(n_batches, size).mean(axis=1)
+    half_width = st.t.ppf((1 + confidence) / 2.0, n_batches - 1) * batches.std(ddof=1) / math.sqrt(n_batches)
+    return float(batches.mean()), float(half_width)
+
+
+def relative_precision(m, half_width):
+    """
+    Ritorna la semi-ampiezza dell'intervallo di confidenza relativa alla media
+    """
+    if half_width == 0:
+        return 0.0
+    if m == 0 or math.isnan(half_width):
+        return float('inf')
+    return half_width / abs(m)
+
+
+def observations(stats, end, bin_width):
+    """
+    Ritorna le serie di osservazioni di StatsManager su cui si valuta lo stato stazionario (traffico in ingresso e in
+    uscita dal server, dispositivi online), come medie su intervalli di ampiezza "bin_width" in [0, end)
+    """
+    edges = numpy.arange(0, end + bin_width, bin_width, dtype=numpy.float64)
+    online = ts.series_step_integral(stats.online_devices, edges)
+    return {
+        'in_traffic': stats.server_load_in.to_dense(end, bin_width)[1],
+        'out_traffic': stats.server_load_out.to_dense(end, bin_width)[1],
+        'online_devices': numpy.diff(online) / bin_width,
+    }
+
+
+class SteadyStateMonitor(object):
+    """
+    Controlla periodicamente le serie di StatsManager durante la simulazione: stima il transitorio iniziale di ciascuna
+    serie (MSER-5), che viene escluso dalla sua media, e segnala quando le stime a regime di tutte le serie hanno
+    raggiunto la precisione relativa richiesta (vedi CloudEnvironment.advance). Se MSER tronca meta' di una serie, la
+    serie non ha raggiunto lo stato stazionario: dalla sua media non viene escluso alcun transitorio (neppure quello
+    stimato da un controllo precedente) e la simulazione non si ferma
+    """
+
+    def __init__(self, precision=0.05, interval=3600, bin_width=60, n_batches=20, confidence=0.95):
+        """
+        :param precision: semi-ampiezza massima dell'intervallo di confidenza, relativa alla media
+        :param interval: intervallo (s) tra due controlli
+        :param bin_width: ampiezza (s) degli intervalli su cui vengono mediate le osservazioni
+        :param n_batches: numero di lotti per le medie a lotti
+        :param confidence: livello di confidenza
+        """
+        self.precision = precision
+        self.interval = interval
+        self.bin_width = bin_width
+        self.n_batches = n_batches
+        self.confidence = confidence
+        # Risultati dell'ultimo controllo: durata del transitorio (s) e precisione relativa delle serie stazionarie, e
+        # serie che non hanno raggiunto lo stato stazionario
+        self.warmups = {}
+        self.precisions = {}
+        self.unsettled = []
+
+    def check(self, stats, now):
+        """
+        Stima il transitorio e la precisione delle serie all'istante "now", e aggiorna i transitori di "stats" (nessuno
+        per le serie non stazionarie) e l'elenco delle serie che non hanno raggiunto lo stato stazionario
+        Ritorna True se tutte le serie sono stazionarie e le loro stime hanno raggiunto la precisione richiesta
+        """
+        n_bins = int(now // self.bin_width)
+        if n_bins < 2 * self.n_batches * MSER_BATCH:
+            return False
+        series = observations(stats, n_bins * self.bin_width, self.bin_width)
+        self.warmups = {}
+        self.precisions = {}
+        self.unsettled = []
+        for name, values in sorted(series.iteritems()):
+            d = mser(values)
+            # Se MSER tronca meta' della serie, il transitorio potrebbe non essere ancora concluso
+            if d + MSER_BATCH > n_bins // 2:
+                self.unsettled.append(name)
+                continue
+            self.warmups[name] = d * self.bin_width
+            self.precisions[name] = relative_precision(*batch_means(values[d:], self.n_batches, self.confidence))
+        stats.warmups = dict(self.warmups)
+        stats.unsettled = list(self.unsettled)
+        if len(self.unsettled) > 0:
+            return False
+        return max(self.precisions.itervalues()) <= self.precision
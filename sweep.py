@@ -0,0 +1,129 @@
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import replications
+
+
+# Cartella in cui vengono salvati i risultati dei punti della griglia
+CACHE_DIR = 'sweep_cache'
+# File il cui contenuto determina i risultati della simulazione: se cambiano, i risultati salvati non sono piu' validi
+SOURCE_FILES = [
+    'cloud_env.py', 'cloud_stats.py', 'device.py', 'file_manager.py', 'missing_files.py', 'peer_index.py',
+    'profiler.py', 'replications.py', 'samplers.py', 'shared_folder.py', 'steady_state.py', 'timed_structures.py',
+    'throughput.txt',
+]
+
+
+def code_version():
+    """
+    Ritorna l'hash del codice sorgente (e dei dati di input) del simulatore
+    """
+    h = hashlib.sha1()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCE_FILES:
+        with open(os.path.join(base, name), 'rb') as fp:
+            h.update(name)
+            h.update(fp.read())
+    return h.hexdigest()
+
+
+def expand_grid(grid, seeds=(0,)):
+    """
+    Ritorna l'elenco delle configurazioni della griglia "grid" (dizionario parametro -> elenco di valori), ciascuna
+    ripetuta per ogni seed in "seeds". I parametri sono quelli di replications.run_replication
+    """
+    keys = sorted(grid)
+    configs = []
+    for values in itertools.product(*[grid[k] for k in keys]):
+        for seed in seeds:
+            config = dict(zip(keys, values))
+            config['seed'] = seed
+            configs.append(config)
+    return configs
+
+
+class ResultCache(object):
+    """
+    Archivio su disco dei risultati, indicizzati dall'hash di configurazione, seed e versione del codice: ogni
+    risultato e' un file JSON, scritto in modo atomico
+    """
+
+    def __init__(self, directory=CACHE_DIR, version=None):
+        self.directory = directory
+        self.version = version if version is not None else code_version()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, config):
+        """
+        Ritorna la chiave del punto "config" della griglia
+        """
+        return hashlib.sha1(json.dumps(config, sort_keys=True) + self.version).hexdigest()
+
+    def path(self, config):
+        return os.path.join(self.directory, self.key(config) + '.json')
+
+    def get(self, config):
+        """
+        Ritorna il risultato salvato per "config", oppure None se assente o illeggibile
+        """
+        try:
+            with open(self.path(config), 'r') as fp:
+                return json.load(fp)['result']
+        except (IOError, ValueError, KeyError):
+            return None
+
+    def put(self, config, result):
+        """
+        Salva il risultato di "config": il file viene prima scritto per intero e poi rinominato, in modo che
+        un'interruzione non lasci risultati parziali
+        """
+        path = self.path(config)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as fp:
+            json.dump({'config': config, 'version': self.version, 'result': result}, fp, sort_keys=True)
+        os.rename(tmp, path)
+
+
+def run_point(config):
+    """
+    Esegue un punto della griglia, ritornando la coppia (configurazione, risultato)
+    """
+    return config, replications.run_replication(config)
+
+
+def sweep(grid, seeds=(0,), cache_dir=CACHE_DIR, processes=None):
+    """
+    Esegue la griglia di parametri "grid" su un pool di "processes" processi (None = numero di core): vengono
+    calcolati solo i punti assenti dall'archivio, e ogni risultato e' salvato appena disponibile, per cui una sweep
+    interrotta riprende da dove si era fermata
+    Ritorna l'elenco di coppie (configurazione, risultato), nell'ordine della griglia
+    """
+    configs = expand_grid(grid, seeds)
+    cache = ResultCache(cache_dir)
+    missing = [c for c in configs if cache.get(c) is None]
+    print('Sweep: %d points, %d cached, %d to run' % (len(configs), len(configs) - len(missing), len(missing)))
+    if len(missing) > 0:
+        pool = multiprocessing.Pool(processes)
+        try:
+            done = 0
+            for config, result in pool.imap_unordered(run_point, missing):
+                cache.put(config, result)
+                done += 1
+                print('Sweep: %d/%d points done' % (done, len(missing)))
+        finally:
+            pool.close()
+            pool.join()
+    return [(c, cache.get(c)) for c in configs]
+
+
+if __name__ == '__main__':
+    GRID = {
+        'n_devices': [100, 300, 500],
+        'server': [True, False],
+        'until': [360000],
+    }
+    for point, summary in sweep(GRID, seeds=range(4)):
+        print('%s -> out traffic: %.2f b/s' % (json.dumps(point, sort_keys=True), summary['mean_out_traffic']))
@@ -0,0 +1,43 @@
+import unittest
+from file_manager import SharedFile
+from missing_files import MissingFiles
+from shared_folder import SharedFolder
+
+
+def version(sf, last_modified):
+    """
+    Ritorna una versione, modificata all'istante "last_modified", dello stesso file logico della cartella "sf"
+    """
+    return SharedFile(7, 1000, 1000.0, sf, last_modified, 0)
+
+
+class MissingFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sf = SharedFolder(0)
+        self.missing = MissingFiles()
+
+    def test_newer_version_notified_during_download_stays_pending(self):
+        v1 = version(self.sf, 10)
+        v2 = version(self.sf, 20)
+        self.missing.add(v1)
+        # v2 viene notificata mentre il dispositivo scarica v1
+        self.missing.add(v2)
+        self.assertFalse(self.missing.remove(v1))
+        self.assertIn(v2, self.missing)
+        self.assertIs(self.missing.last(self.sf), v2)
+        self.assertEqual(len(self.missing), 1)
+        self.assertTrue(self.missing.remove(v2))
+        self.assertEqual(len(self.missing), 0)
+
+    def test_download_of_newer_version_removes_older(self):
+        self.missing.add(version(self.sf, 10))
+        self.assertTrue(self.missing.remove(version(self.sf, 20)))
+        self.assertEqual(self.missing.count(self.sf), 0)
+
+    def test_remove_missing_file_raises(self):
+        self.assertRaises(KeyError, self.missing.remove, version(self.sf, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
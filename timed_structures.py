@@ -1,8 +1,15 @@
+import os
+import numpy
+from collections import deque
+
+
 class TimedData(object):
     """
     Struttura dati per eventi accompagnati da un informazione temporale discreta (timestamp o intervallo)
     """
 
+    __slots__ = ('data', 'time', 'timestamp')
+
     def __init__(self, data, time, timestamp=True):
         """
         I parametri di input sono
@@ -265,3 +272,432 @@ class TimedArray(object):
             self.append(
                 TimedData(data_value, time_to_search, self.timestamp)
             )
+
+
+class CompactTimedArray(object):
+    """
+    Versione compatta di TimedArray: i campi "data" e "time" sono memorizzati in due vettori NumPy paralleli, che
+    raddoppiano la propria capacita' quando si riempiono. Non vengono creati oggetti TimedData per i singoli campioni
+    """
+
+    def __init__(self, timestamp=True, empty=True, data_type=numpy.int64, capacity=1024):
+        """
+        I parametri "timestamp" ed "empty" hanno lo stesso significato che assumono in TimedArray
+        - "data_type": tipo NumPy del campo "data"
+        - "capacity": numero di campioni allocati inizialmente
+        """
+        capacity = max(int(capacity), 1)
+        self._time = numpy.empty(capacity, dtype=numpy.int64)
+        self._data = numpy.empty(capacity, dtype=data_type)
+        self._size = 0
+        self.timestamp = (timestamp is True)
+        if not empty:
+            # Creo il nodo di partenza
+            self.append(0, 0)
+
+    def __len__(self):
+        return self._size
+
+    def __str__(self):
+        x = ', '.join(['(data=%s, time=%s)' % (d, t) for d, t in zip(self.get_data_list(), self.get_time_list())])
+        return '(timestamp=%s, [%s]' % (self.timestamp, x)
+
+    def get_data_list(self):
+        """
+        Ritorna gli attributi "data" di ogni elemento del vettore, come vista NumPy (non copiare se non necessario)
+        """
+        return self._data[:self._size]
+
+    def get_time_list(self):
+        """
+        Ritorna gli attributi "time" di ogni elemento del vettore, come vista NumPy (non copiare se non necessario)
+        """
+        return self._time[:self._size]
+
+    def has_time_intervals(self):
+        """
+        Ritorna True se gli elementi del vettore hanno associato un intervallo temporale
+        """
+        return self.timestamp is False
+
+    def iter_chunks(self, chunk_size=65536):
+        """
+        Ritorna i campioni a blocchi, come coppie di vettori (time, data): i campioni sono gia' in memoria, per cui
+        il blocco e' uno solo (vedi SpillingTimedArray)
+        """
+        yield self.get_time_list(), self.get_data_list()
+
+    def _grow(self):
+        """
+        Raddoppia la capacita' dei vettori interni
+        """
+        capacity = 2 * len(self._time)
+        self._time = numpy.resize(self._time, capacity)
+        self._data = numpy.resize(self._data, capacity)
+
+    def append(self, data, time):
+        """
+        Accodo un campione: come in TimedData, il campo "time" viene troncato ad intero
+        """
+        if self._size == len(self._time):
+            self._grow()
+        self._time[self._size] = time
+        self._data[self._size] = data
+        self._size += 1
+
+    def insert_or_update(self, time_to_search, data_value):
+        """
+        Aggiorna il campo "data" dei campioni con timestamp "time_to_search" o, se non ve ne sono, ne accoda uno nuovo
+        """
+        t = int(time_to_search)
+        n = self._size
+        # Caso tipico: i timestamp arrivano in ordine non decrescente, quindi basta guardare l'ultimo campione
+        if n > 0 and self._time[n - 1] == t:
+            self._data[n - 1] = data_value
+            return
+        if n == 0 or self._time[n - 1] < t:
+            self.append(data_value, t)
+            return
+        matches = self._time[:n] == t
+        if matches.any():
+            self._data[:self._size][matches] = data_value
+        else:
+            self.append(data_value, time_to_search)
+
+
+class SpillingTimedArray(CompactTimedArray):
+    """
+    Versione di CompactTimedArray con memoria limitata: quando il blocco in memoria (di "chunk_size" campioni) e' pieno,
+    i campioni vengono accodati su disco in due file colonnari ("<path>.time" e "<path>.data", valori binari grezzi).
+    L'ultimo campione resta sempre in memoria: insert_or_update aggiorna solo i campioni non ancora scritti su disco
+    """
+
+    def __init__(self, path, chunk_size=65536, timestamp=True, empty=True, data_type=numpy.int64):
+        """
+        :param path: prefisso dei file su disco (eventuali file esistenti vengono sovrascritti)
+        :param chunk_size: numero di campioni mantenuti in memoria
+        """
+        self.path = path
+        self._spilled = 0
+        for name in (path + '.time', path + '.data'):
+            open(name, 'wb').close()
+        super(SpillingTimedArray, self).__init__(timestamp, empty, data_type, max(int(chunk_size), 2))
+
+    def __len__(self):
+        return self._spilled + self._size
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # I file su disco possono contenere campioni scritti dopo il salvataggio dello stato: li scarto
+        for suffix, column in (('.time', self._time), ('.data', self._data)):
+            name = self.path + suffix
+            size = self._spilled * column.dtype.itemsize
+            if os.path.getsize(name) < size:
+                raise IOError('"%s" is shorter than the saved series' % name)
+            with open(name, 'r+b') as fp:
+                fp.truncate(size)
+
+    def _grow(self):
+        """
+        Il blocco in memoria e' pieno: lo accodo su disco, ad eccezione dell'ultimo campione
+        """
+        n = self._size - 1
+        with open(self.path + '.time', 'ab') as fp:
+            self._time[:n].tofile(fp)
+        with open(self.path + '.data', 'ab') as fp:
+            self._data[:n].tofile(fp)
+        self._spilled += n
+        self._time[0] = self._time[n]
+        self._data[0] = self._data[n]
+        self._size = 1
+
+    def _read(self, suffix, dtype):
+        """
+        Ritorna i campioni su disco di una colonna, come vettore mappato in memoria
+        """
+        if self._spilled == 0:
+            return numpy.empty(0, dtype=dtype)
+        return numpy.memmap(self.path + suffix, dtype=dtype, mode='r', shape=(self._spilled,))
+
+    def iter_chunks(self, chunk_size=65536):
+        """
+        Ritorna i campioni a blocchi, come coppie di vettori (time, data), leggendoli progressivamente dal disco
+        """
+        times = self._read('.time', self._time.dtype)
+        data = self._read('.data', self._data.dtype)
+        for i in range(0, self._spilled, chunk_size):
+            yield numpy.array(times[i:i + chunk_size]), numpy.array(data[i:i + chunk_size])
+        yield self._time[:self._size], self._data[:self._size]
+
+    def get_data_list(self):
+        """
+        Ritorna gli attributi "data" di ogni elemento del vettore: i dati su disco vengono copiati interamente in
+        memoria, per cui le elaborazioni sull'intera serie devono usare "iter_chunks" (vedi series_sum)
+        """
+        return numpy.concatenate((self._read('.data', self._data.dtype), self._data[:self._size]))
+
+    def get_time_list(self):
+        """
+        Ritorna gli attributi "time" di ogni elemento del vettore: come "get_data_list", copia in memoria tutti i dati
+        """
+        return numpy.concatenate((self._read('.time', self._time.dtype), self._time[:self._size]))
+
+
+class MemorySink(object):
+    """
+    Crea le serie storiche di StatsManager interamente in memoria
+    """
+
+    def series(self, name, timestamp=True, empty=True, data_type=numpy.int64):
+        return CompactTimedArray(timestamp, empty, data_type)
+
+
+class DiskSink(object):
+    """
+    Crea le serie storiche di StatsManager come SpillingTimedArray, nella cartella "directory": la memoria occupata da
+    ciascuna serie e' limitata a "chunk_size" campioni, indipendentemente dalla durata della simulazione
+    """
+
+    def __init__(self, directory, chunk_size=65536):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def series(self, name, timestamp=True, empty=True, data_type=numpy.int64):
+        return SpillingTimedArray(os.path.join(self.directory, name), self.chunk_size, timestamp, empty, data_type)
+
+
+class PendingIntervals(object):
+    """
+    Tabella degli intervalli aperti (login, download, upload in corso), indicizzata per chiave. Ad una stessa chiave
+    possono corrispondere piu' intervalli aperti: vengono chiusi nello stesso ordine in cui sono stati aperti
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        return key in self._pending
+
+    def open(self, key, time):
+        """
+        Apre un nuovo intervallo per la chiave "key", a partire dall'istante "time"
+        """
+        starts = self._pending.get(key)
+        if starts is None:
+            self._pending[key] = time
+        elif isinstance(starts, deque):
+            starts.append(time)
+        else:
+            # Chiave duplicata: passo ad una coda di istanti di inizio
+            self._pending[key] = deque([starts, time])
+        self._size += 1
+
+    def close(self, key):
+        """
+        Chiude l'intervallo piu' vecchio associato alla chiave "key" e ne ritorna l'istante di inizio
+        """
+        starts = self._pending.get(key)
+        if starts is None:
+            raise KeyError(key)
+        if isinstance(starts, deque):
+            time = starts.popleft()
+            if len(starts) == 1:
+                self._pending[key] = starts[0]
+        else:
+            time = starts
+            del self._pending[key]
+        self._size -= 1
+        return time
+
+
+def step_integral(times, values, points):
+    """
+    Ritorna l'integrale, tra l'istante 0 e ciascuno degli istanti "points", della funzione costante a tratti che vale
+    values[i] a partire da times[i] (in ordine crescente) e 0 prima di times[0]
+    """
+    points = numpy.asarray(points, dtype=numpy.float64)
+    res = numpy.zeros(len(points))
+    if len(times) == 0:
+        return res
+    times = numpy.asarray(times, dtype=numpy.float64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    # Integrale cumulato in corrispondenza di ogni variazione
+    cumulated = numpy.zeros(len(times))
+    cumulated[1:] = numpy.cumsum(values[:-1] * numpy.diff(times))
+    # Interpolazione lineare all'interno del tratto costante in cui cade ciascun punto
+    k = numpy.searchsorted(times, points, side='right') - 1
+    valid = k >= 0
+    k = k[valid]
+    res[valid] = cumulated[k] + values[k] * (points[valid] - times[k])
+    return res
+
+
+def series_sum(array):
+    """
+    Ritorna la somma dei campi "time" di un CompactTimedArray o SpillingTimedArray, letti a blocchi
+    """
+    total = 0
+    for times, _ in array.iter_chunks():
+        total += times.sum()
+    return total
+
+
+def series_step_integral(array, points):
+    """
+    Come step_integral, per la funzione costante a tratti memorizzata in un CompactTimedArray o SpillingTimedArray
+    (istanti in ordine non decrescente), letta a blocchi: l'integrale e' la somma di quelli dei singoli blocchi, in
+    cui ogni valore e' espresso come differenza rispetto all'ultimo valore del blocco precedente
+    """
+    res = numpy.zeros(len(points))
+    carry = 0.0
+    for times, data in array.iter_chunks():
+        if len(times) == 0:
+            continue
+        res += step_integral(times, numpy.asarray(data, dtype=numpy.float64) - carry, points)
+        carry = float(data[-1])
+    return res
+
+
+def bucket_extremes(times, values, t0, span, n_buckets):
+    """
+    Divide l'intervallo [t0, t0 + span] in "n_buckets" intervalli di uguale ampiezza, e ritorna gli indici (ordinati)
+    dei campioni (times[i], values[i]), con tempi in ordine crescente, di valore minimo e massimo in ciascuno di essi,
+    oltre al primo e all'ultimo campione
+    """
+    n = len(times)
+    # Intervallo di appartenenza di ogni campione: non decrescente, dato che i tempi sono ordinati
+    if span > 0:
+        buckets = numpy.clip(((times - t0) / span * n_buckets).astype(numpy.int64), 0, n_buckets - 1)
+    else:
+        buckets = numpy.zeros(n, dtype=numpy.int64)
+    starts = numpy.append(0, numpy.flatnonzero(numpy.diff(buckets)) + 1)
+    ends = numpy.append(starts[1:], n)
+    # Ordinando per (intervallo, valore), il primo e l'ultimo campione di ogni intervallo sono il minimo e il massimo
+    order = numpy.lexsort((values, buckets))
+    return numpy.unique(numpy.concatenate((order[starts], order[ends - 1], [0, n - 1])))
+
+
+def downsample(times, values, max_points):
+    """
+    Riduce la serie (times[i], values[i]), in ordine di tempo crescente, ad al piu' "max_points" campioni per il
+    grafico: l'asse dei tempi viene diviso in (max_points - 2) / 2 intervalli di uguale ampiezza (i "pixel"), e di
+    ciascuno vengono mantenuti solo i campioni di valore minimo e massimo, oltre al primo e all'ultimo della serie.
+    I picchi restano visibili, a differenza di un sottocampionamento regolare
+    Ritorna la coppia (istanti, valori) dei campioni mantenuti, come array numpy
+    """
+    times = numpy.asarray(times)
+    values = numpy.asarray(values)
+    n = len(times)
+    if max_points is None or n <= max(max_points, 4):
+        return times, values
+    keep = bucket_extremes(times, values, times[0], float(times[-1] - times[0]), max(1, (max_points - 2) // 2))
+    return times[keep], values[keep]
+
+
+def series_downsample(array, max_points):
+    """
+    Come downsample, per un CompactTimedArray o SpillingTimedArray letto a blocchi: vengono mantenuti anche il primo e
+    l'ultimo campione di ogni blocco, per cui il risultato puo' superare "max_points" di qualche campione per blocco
+    """
+    if max_points is None or len(array) <= max(max_points, 4):
+        return array.get_time_list(), array.get_data_list()
+    # Primo passaggio: estremi dell'asse dei tempi
+    t0 = None
+    t1 = None
+    for times, _ in array.iter_chunks():
+        if len(times) > 0:
+            t0 = times[0] if t0 is None else t0
+            t1 = times[-1]
+    span = float(t1 - t0)
+    n_buckets = max(1, (max_points - 2) // 2)
+    res_times = []
+    res_values = []
+    for times, data in array.iter_chunks():
+        if len(times) > 0:
+            keep = bucket_extremes(times, data, t0, span, n_buckets)
+            res_times.append(times[keep])
+            res_values.append(data[keep])
+    return numpy.concatenate(res_times), numpy.concatenate(res_values)
+
+
+class StepSeries(object):
+    """
+    Serie costante a tratti (es. carico sul server), memorizzata come elenco di variazioni di valore: ogni contributo
+    costa due campioni, indipendentemente dalla sua durata. La serie densa viene calcolata solo quando richiesta
+    """
+
+    def __init__(self, bin_width=1, changes=None):
+        """
+        - "bin_width": ampiezza (in secondi) degli intervalli su cui viene mediata la serie densa
+        - "changes": vettore (vuoto) in cui memorizzare le variazioni, con "data" di tipo float (default: in memoria)
+        """
+        self.bin_width = bin_width
+        self._changes = changes if changes is not None else CompactTimedArray(data_type=numpy.float64)
+
+    def __len__(self):
+        return len(self._changes)
+
+    def add(self, start, end, value):
+        """
+        Somma "value" alla serie nell'intervallo di tempo [start, end)
+        """
+        if end > start:
+            self._changes.append(value, start)
+            self._changes.append(-value, end)
+
+    def integral(self, points):
+        """
+        Ritorna l'integrale della serie tra l'istante 0 e ciascuno degli istanti "points"
+        """
+        # L'integrale e' lineare nelle variazioni: sommo quelli dei blocchi di variazioni letti dal vettore. In ogni
+        # blocco ordino le variazioni per istante di applicazione: il valore della serie e' la loro somma cumulata
+        res = numpy.zeros(len(points))
+        for times, data in self._changes.iter_chunks():
+            order = numpy.argsort(times, kind='mergesort')
+            res += step_integral(times[order], numpy.cumsum(data[order]), points)
+        return res
+
+    def mean(self, start, end):
+        """
+        Ritorna il valor medio della serie nell'intervallo [start, end)
+        """
+        i_start, i_end = self.integral([start, end])
+        return (i_end - i_start) / (end - start)
+
+    def to_dense(self, end, bin_width=None, start=0):
+        """
+        Ritorna la serie densa nell'intervallo [start, end), come coppia (istanti di inizio, valori medi) di intervalli
+        di ampiezza "bin_width" (l'ultimo intervallo puo' essere piu' corto)
+        """
+        if bin_width is None:
+            bin_width = self.bin_width
+        edges = numpy.append(numpy.arange(start, end, bin_width, dtype=numpy.float64), float(end))
+        return edges[:-1], numpy.diff(self.integral(edges)) / numpy.diff(edges)
+
+    def downsample(self, end, max_points, bin_width=None, window=65536):
+        """
+        Come downsample(*self.to_dense(end, bin_width), max_points), senza costruire l'intera serie densa: questa viene
+        calcolata a finestre di "window" intervalli, di ciascuna delle quali vengono mantenuti solo i campioni di
+        valore minimo e massimo di ogni "pixel". In memoria restano al piu' una finestra e i campioni ridotti
+        """
+        if bin_width is None:
+            bin_width = self.bin_width
+        if max_points is None or end <= bin_width * max(max_points, 4):
+            return self.to_dense(end, bin_width)
+        n_buckets = max(1, (max_points - 2) // 2)
+        res_times = []
+        res_values = []
+        start = 0
+        while start < end:
+            times, values = self.to_dense(min(start + bin_width * window, end), bin_width, start)
+            keep = bucket_extremes(times, values, 0, float(end), n_buckets)
+            res_times.append(times[keep])
+            res_values.append(values[keep])
+            start += bin_width * window
+        return numpy.concatenate(res_times), numpy.concatenate(res_values)